@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import openai
+from openai import AsyncOpenAI
+
+from code_metrics_integrated import analyze_code
+from metrics_cache import DEFAULT_CACHE_DIR, AnalysisCache
+from pdfreport import GPT_MODEL, save_metrics_json, save_report_outputs
+from project_metrics import available_cores, collect_files
+from prompt_builder import DEFAULT_PROMPT_BUDGET, PROMPT_VERSION, build_prompt, count_tokens
+
+# Completion budget reserved per request, on top of the counted prompt tokens,
+# when charging the tokens-per-minute limiter.
+COMPLETION_TOKEN_ESTIMATE = 1500
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+class TokenRateLimiter:
+    """
+    Token bucket refilled continuously at tokens_per_minute. Requests larger
+    than the whole bucket are charged the full bucket so they still go out.
+    """
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) * 60 / self.capacity)
+
+def estimate_tokens(prompt):
+    return count_tokens(prompt, GPT_MODEL) + COMPLETION_TOKEN_ESTIMATE
+
+def is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and (
+        error.status_code == 429 or error.status_code >= 500)
+
+def backoff_delay(attempt, error):
+    # Honour the server's Retry-After when it sends one, otherwise use
+    # exponential backoff with full jitter.
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+async def request_analysis(client, prompt, semaphore, limiter, max_retries):
+    attempt = 0
+    while True:
+        await limiter.acquire(estimate_tokens(prompt))
+        async with semaphore:
+            try:
+                response = await client.chat.completions.create(
+                    model=GPT_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                )
+                return response.choices[0].message.content
+            except openai.APIError as e:
+                if attempt >= max_retries or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt, e)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+async def process_file(path, client, executor, semaphore, limiter, cache, args):
+    loop = asyncio.get_running_loop()
+    with open(path, 'r', encoding='utf-8') as f:
+        code = f.read()
+    # Metrics and PDF building run on the process pool, so they overlap with
+    # the network-bound GPT requests of other files.
+    metrics = await loop.run_in_executor(executor, partial(analyze_code, path, code=code, granular=True))
+    # Per-function metrics only rank the functions for the prompt.
+    granular = metrics.pop('granular_metrics')
+    if not args.no_json:
+        save_metrics_json(path, metrics)
+
+    key = cache.key(code, metrics, GPT_MODEL, f"{PROMPT_VERSION}:{args.prompt_budget}") if cache else None
+    analysis = cache.get(key) if cache else None
+    if analysis is None:
+        analysis = await request_analysis(
+            client, build_prompt(code, metrics, granular, args.prompt_budget), semaphore, limiter,
+            args.max_retries)
+        if cache:
+            cache.put(key, analysis)
+
+    await loop.run_in_executor(executor, save_report_outputs, path, code, metrics, analysis)
+
+async def run_batch(files, args):
+    client = AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url=args.base_url,
+        max_retries=0,  # retries are handled here, with the rate limiter
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limiter = TokenRateLimiter(args.tokens_per_minute)
+    cache = None if args.no_cache else AnalysisCache(args.cache_dir)
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers or available_cores()) as executor:
+            outcomes = await asyncio.gather(
+                *(process_file(path, client, executor, semaphore, limiter, cache, args) for path in files),
+                return_exceptions=True
+            )
+    finally:
+        if cache:
+            cache.close()
+        await client.close()
+    return {path: outcome for path, outcome in zip(files, outcomes) if isinstance(outcome, BaseException)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate code quality PDF reports for many files concurrently.")
+    parser.add_argument('target', help="directory or glob pattern of Python files")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="maximum GPT requests in flight")
+    parser.add_argument('--tokens-per-minute', type=int, default=200000,
+                        help="token budget per minute shared by all requests")
+    parser.add_argument('--prompt-budget', type=int, default=DEFAULT_PROMPT_BUDGET,
+                        help="maximum prompt size in tokens")
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="retries on 429/5xx and connection errors")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="processes for metrics and PDF building (default: available cores)")
+    parser.add_argument('--base-url', default=None,
+                        help="chat-completions API base URL (e.g. a local stand-in server)")
+    parser.add_argument('--no-json', action='store_true',
+                        help="don't write the metrics JSON to Metrics_jsons/")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="directory holding the GPT analysis cache")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always request fresh GPT analyses")
+    args = parser.parse_args()
+
+    files = collect_files(args.target)
+    errors = asyncio.run(run_batch(files, args))
+    print(f"Generated {len(files) - len(errors)} of {len(files)} reports.")
+    for path, error in errors.items():
+        print(f"  {path}: {type(error).__name__}: {error}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import networkx as nx
+
+from project_index import ProjectIndex, module_node, unit_node
+
+HOTSPOT_COUNT = 10
+# Exact betweenness is O(V * E); past this many nodes it is estimated from a
+# fixed-seed sample of source nodes so reports stay reproducible.
+BETWEENNESS_SAMPLE = 500
+ENTRY_POINT_NAMES = ('main',)
+
+def build_call_graph(summaries, root):
+    """
+    Directed call graph of the project's functions and methods from the
+    per-file project summaries (see ProjectIndex).
+    Module-level code is a node of its own; edges carry the number of call
+    sites. Calls that do not resolve to project code are counted on the
+    caller as external_calls.
+    """
+    index = ProjectIndex(summaries, root)
+    graph = nx.DiGraph()
+    graph.graph['references'] = set()
+    for module, info in index.modules.items():
+        graph.add_node(module_node(module), type='module', path=info['path'], lines=None,
+                       decorated=False, external_calls=0)
+        for qualname, definition in info['definitions'].items():
+            if definition['type'] != 'class':
+                graph.add_node(unit_node(module, qualname), type=definition['type'], path=info['path'],
+                               lines=definition['lines'], decorated=definition['decorated'], external_calls=0)
+    for module, info in index.modules.items():
+        graph.graph['references'].update(summaries[info['path']]['references'])
+        for caller, callee, count in info['calls']:
+            source = unit_node(module, caller) if caller else module_node(module)
+            target = index.resolve_call(module, caller, callee)
+            if target is None:
+                graph.nodes[source]['external_calls'] += count
+                # obj.method() cannot be resolved without types; keep any
+                # function of that name off the dead list.
+                graph.graph['references'].add(callee.rsplit('.', 1)[-1])
+            elif graph.has_edge(source, target):
+                graph[source][target]['calls'] += count
+            else:
+                graph.add_edge(source, target, calls=count)
+    return graph
+
+def is_dead_candidate(graph, node, data):
+    """
+    Never called from project code and not plausibly reached another way:
+    dunder methods, main(), tests, decorated functions (often registered
+    by the decorator) and names used as values anywhere in the project
+    (callbacks, getattr tables, re-exports) or called on an object whose
+    type is unknown are kept.
+    """
+    if data['type'] == 'module' or data['decorated']:
+        return False
+    if any(caller != node for caller in graph.predecessors(node)):
+        return False
+    name = node.rsplit('.', 1)[-1].rsplit(':', 1)[-1]
+    if (name.startswith('__') and name.endswith('__')) or name in ENTRY_POINT_NAMES or name.startswith('test'):
+        return False
+    return name not in graph.graph['references']
+
+def call_graph_report(graph, hotspot_count=HOTSPOT_COUNT):
+    """
+    Project-wide fan-in/fan-out (distinct callers and callees) per function,
+    the functions that sit on the most call paths (betweenness centrality)
+    and dead-function candidates.
+    """
+    if len(graph) > BETWEENNESS_SAMPLE:
+        betweenness = nx.betweenness_centrality(graph, k=BETWEENNESS_SAMPLE, seed=0)
+    else:
+        betweenness = nx.betweenness_centrality(graph)
+    functions = {}
+    for node, data in sorted(graph.nodes(data=True)):
+        if data['type'] == 'module':
+            continue
+        functions[node] = {
+            'type': data['type'],
+            'path': data['path'],
+            'lines': data['lines'],
+            'fan_in': graph.in_degree(node),
+            'fan_out': graph.out_degree(node),
+            'call_sites_in': sum(calls for _, _, calls in graph.in_edges(node, data='calls')),
+            'external_calls': data['external_calls'],
+            'betweenness': betweenness[node]
+        }
+    hotspots = sorted((node for node in functions if functions[node]['betweenness'] > 0),
+                      key=lambda node: (-functions[node]['betweenness'], node))[:hotspot_count]
+    return {
+        'summary': {
+            'modules': sum(1 for _, data in graph.nodes(data=True) if data['type'] == 'module'),
+            'functions': len(functions),
+            'edges': graph.number_of_edges(),
+            'resolved_calls': sum(calls for _, _, calls in graph.edges(data='calls')),
+            'external_calls': sum(data['external_calls'] for _, data in graph.nodes(data=True))
+        },
+        'hotspots': [
+            {'function': node, 'betweenness': functions[node]['betweenness'],
+             'fan_in': functions[node]['fan_in'], 'fan_out': functions[node]['fan_out']}
+            for node in hotspots
+        ],
+        'dead_function_candidates': sorted(node for node, data in graph.nodes(data=True)
+                                           if is_dead_candidate(graph, node, data)),
+        'functions': functions
+    }
@@ -0,0 +1,73 @@
+from code_metrics_integrated import children_counts, inheritance_depths
+from project_index import ProjectIndex, unit_node
+
+def resolve_base(index, module, qualname, base):
+    """(module, qualname) of the project class `base` names, or None."""
+    definitions = index.modules[module]['definitions']
+    scope = qualname.rsplit('.', 1)[0] if '.' in qualname else None
+    # Bases are evaluated in the enclosing scope, which for a nested class
+    # includes the body of the class around it.
+    if scope and definitions[scope]['type'] == 'class' and f"{scope}.{base.split('.')[0]}" in definitions:
+        target = index.resolve_in_module(module, f"{scope}.{base}")
+    else:
+        target = index.resolve_name(module, scope, base)
+    if target is None or index.modules[target[0]]['definitions'][target[1]]['type'] != 'class':
+        return None
+    return target
+
+def build_class_hierarchy(summaries, root):
+    """
+    Project-wide class hierarchy from the per-file project summaries. Bases
+    are resolved through imports with ProjectIndex; bases outside the
+    project (object, Exception, library classes) are listed but, as in the
+    per-file DIT, add no depth. DIT and NOC are computed once per class for
+    the whole project, in time linear in classes plus base references.
+    """
+    index = ProjectIndex(summaries, root)
+    classes = {}
+    bases = {}
+    for module, info in index.modules.items():
+        for qualname, definition in info['definitions'].items():
+            if definition['type'] != 'class':
+                continue
+            node = unit_node(module, qualname)
+            resolved, external = [], []
+            for base in definition['bases']:
+                target = resolve_base(index, module, qualname, base)
+                if target is None:
+                    external.append(base)
+                else:
+                    resolved.append(unit_node(*target))
+            bases[node] = resolved
+            classes[node] = {
+                'qualified_name': qualname,
+                'path': info['path'],
+                'lines': definition['lines'],
+                'bases': resolved,
+                'external_bases': external
+            }
+    depths = inheritance_depths(bases)
+    children = children_counts(bases)
+    for node, cls in classes.items():
+        cls['dit'] = depths[node]
+        cls['noc'] = children[node]
+    return {
+        'summary': {
+            'classes': len(classes),
+            'max_dit': max(depths.values(), default=0),
+            'unresolved_bases': sum(len(cls['external_bases']) for cls in classes.values())
+        },
+        'classes': dict(sorted(classes.items()))
+    }
+
+def apply_to_granular(hierarchy, files):
+    """
+    Replace the file-local DIT and NOC of each class in the granular metrics
+    of `files` ({path: analyze_code result}) with the project-wide values.
+    """
+    for cls in hierarchy['classes'].values():
+        granular = files.get(cls['path'], {}).get('granular_metrics')
+        key = f"{cls['qualified_name']}:{cls['lines'][0]}-{cls['lines'][1]}"
+        if granular and key in granular:
+            granular[key]['dit'] = cls['dit']
+            granular[key]['noc'] = cls['noc']
@@ -3,7 +3,7 @@ import os
 from radon.complexity import cc_visit
 from radon.metrics import h_visit, mi_visit
 from radon.visitors import HalsteadVisitor
-from collections import defaultdict
+from collections import defaultdict, deque
 import networkx as nx
 
 class CodeMetricsAnalyzer:
@@ -18,21 +18,16 @@ class CodeMetricsAnalyzer:
         self.imports = []
         self.calls = defaultdict(list)
         
-        # Set parent attributes for all AST nodes
-        self.attach_parents(self.tree)
-        
         self.visit_ast()
 
-    def attach_parents(self, node, parent=None):
-        """
-        Recursively attach a 'parent' attribute to each node in the AST.
-        """
-        node.parent = parent
-        for child in ast.iter_child_nodes(node):
-            self.attach_parents(child, node)
-
     def visit_ast(self):
-        for node in ast.walk(self.tree):
+        # Breadth-first like ast.walk, but each queued node carries the name of
+        # the function it sits in, so calls are attributed without parent links.
+        todo = deque([(self.tree, None)])
+        while todo:
+            node, current_func = todo.popleft()
+            child_func = node.name if isinstance(node, ast.FunctionDef) else current_func
+            todo.extend((child, child_func) for child in ast.iter_child_nodes(node))
             if isinstance(node, ast.ClassDef):
                 self.process_class(node)
             elif isinstance(node, ast.FunctionDef):
@@ -40,7 +35,7 @@ class CodeMetricsAnalyzer:
             elif isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
                 self.process_import(node)
             elif isinstance(node, ast.Call):
-                self.process_call(node)
+                self.process_call(node, current_func)
 
     def process_class(self, node):
         bases = [base.id if isinstance(base, ast.Name) else None for base in node.bases]
@@ -70,23 +65,12 @@ class CodeMetricsAnalyzer:
             for alias in node.names:
                 self.imports.append(f"{module}.{alias.name}")
 
-    def process_call(self, node):
+    def process_call(self, node, current_func):
         if isinstance(node.func, ast.Name):
             func_name = node.func.id
-            current_func = self.get_current_function(node)
             if current_func:
                 self.calls[current_func].append(func_name)
 
-    def get_current_function(self, node):
-        """
-        Traverse upwards to find the enclosing function for a given node.
-        """
-        while node:
-            if isinstance(node, ast.FunctionDef):
-                return node.name
-            node = node.parent
-        return None
-
     def calculate_LOC(self):
         code_lines = [line for line in self.lines if line.strip()]
         return len(code_lines)
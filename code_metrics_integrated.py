@@ -1,56 +1,306 @@
+import argparse
 import ast
+import hashlib
+import io
 import json
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
 import os
-from radon.complexity import cc_visit
-from radon.metrics import h_visit, mi_visit
-from radon.visitors import HalsteadVisitor
-import sys
-
-class CodeMetricsAnalyzer:
-    def __init__(self, filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            self.code = f.read()
-        self.tree = ast.parse(self.code)
-        self.lines = self.code.splitlines()
-        self.filepath = filepath
+import time
+import tokenize
+
+from complexity import FUNCTION_TYPES, ComplexityCounter
+from halstead import HalsteadCounter, HalsteadCounts
+from line_counts import LineClassifier, SegmentedClassifier
+from maintainability import DEFAULT_MI_VARIANT, MI_VARIANTS, maintainability_index
+
+# Bump whenever a change alters computed metric values, so cached results
+# from older analyzer versions are not served.
+ANALYZER_VERSION = '2.7'
+
+class ParsedSource:
+    """
+    Parses a source file exactly once and tokenizes each part of it at most
+    once. The analyzer, its counters and the line classifier consume this
+    shared tree and these token streams instead of re-reading the code
+    string.
+    """
+    # Parses and tokenizations that cc_visit, h_visit and mi_visit would each
+    # have performed again on the raw code string.
+    PARSES_AVOIDED = 3
+    TOKENIZATIONS_AVOIDED = 1
+
+    def __init__(self, code):
+        self.code = code
+        self.lines = code.splitlines()
+        # Lines as the tokenizer reads them, endings included.
+        self.physical_lines = io.StringIO(code).readlines()
+        start = time.perf_counter()
+        self.tree = ast.parse(code)
+        self.parse_time = time.perf_counter() - start
+        self.tokenize_time = 0
+
+    def digest(self, first=1, last=None):
+        """Fingerprint of the source of rows first..last (the whole file by default)."""
+        return hashlib.sha256(''.join(self.physical_lines[first - 1:last]).encode('utf-8')).hexdigest()
+
+    def logical_lines(self, first=1, last=None):
+        """
+        Tokenize rows first..last (the whole file by default), which must
+        hold whole statements, and split the tokens into logical lines,
+        yielding each line's tokens together with the stripped physical
+        lines it spans. Token rows count from `first`.
+        """
+        start = time.perf_counter()
+        code = ''.join(self.physical_lines[first - 1:last])
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+        self.tokenize_time += time.perf_counter() - start
+        group = []
+        depth = 0
+        for token in tokens:
+            if token.type in (tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+                continue
+            group.append(token)
+            if token.type == tokenize.OP and token.string in ('(', '[', '{'):
+                depth += 1
+            elif token.type == tokenize.OP and token.string in (')', ']', '}'):
+                depth -= 1
+            elif token.type == tokenize.NEWLINE or (token.type == tokenize.NL and depth == 0):
+                start_row, end_row = group[0].start[0] + first - 1, token.end[0] + first - 1
+                yield group, [line.strip() for line in self.lines[start_row - 1:end_row]]
+                group = []
+
+    def parse_stats(self):
+        time_saved = (self.PARSES_AVOIDED * self.parse_time +
+                      self.TOKENIZATIONS_AVOIDED * self.tokenize_time)
+        return {
+            'parse_time': self.parse_time,
+            'tokenize_time': self.tokenize_time,
+            'parses_avoided': self.PARSES_AVOIDED,
+            'tokenizations_avoided': self.TOKENIZATIONS_AVOIDED,
+            'time_saved': time_saved
+        }
+
+class SymbolTable:
+    """
+    Functions, methods and classes found during the traversal, indexed by AST
+    node and by qualified name. Each symbol records its kind, line span and
+    enclosing symbol; classes also map method names to nodes. Attribute and
+    call sets are frozen once the traversal is done, so every metric does
+    O(1) lookups instead of rescanning class bodies.
+    """
+    def __init__(self):
+        self.by_node = {}
+        self.by_name = {}
+
+    def add(self, node, qualified_name, kind, parent):
+        symbol = {
+            'node': node,
+            'qualified_name': qualified_name,
+            'type': kind,
+            'parent': parent,
+            'lines': (node.lineno, node.end_lineno),
+            'methods': {},
+            'attributes': frozenset(),
+            'external_calls': frozenset(),
+            'fan_out': 0
+        }
+        self.by_node[node] = symbol
+        # As with a scan of the class body, the first definition of a name wins.
+        self.by_name.setdefault(qualified_name, symbol)
+        return symbol
+
+    def update(self, other, line_offset=0, parent=None):
+        """
+        Add the symbols of another table, moved down `line_offset` lines. With
+        a `parent` class, the other table is of one of its methods, collected
+        as if it stood alone, and its names are qualified with the class's.
+        """
+        prefix = self.by_node[parent]['qualified_name'] + '.' if parent is not None else None
+        for node, symbol in other.by_node.items():
+            if line_offset or parent is not None:
+                first, last = symbol['lines']
+                symbol = dict(symbol, lines=(first + line_offset, last + line_offset))
+            if parent is not None:
+                symbol['qualified_name'] = prefix + symbol['qualified_name']
+                if symbol['parent'] is None:
+                    symbol.update(parent=parent, type='method')
+            self.by_node[node] = symbol
+            self.by_name.setdefault(symbol['qualified_name'], symbol)
+
+    def __contains__(self, node):
+        return node in self.by_node
+
+    def __getitem__(self, node):
+        return self.by_node[node]
+
+    def items(self):
+        return self.by_node.items()
+
+    def lookup(self, qualified_name):
+        return self.by_name.get(qualified_name)
+
+# What a node sits inside: the nearest FunctionDef name (calls are attributed
+# to it), the nearest function or method, the nearest unit of any kind and
+# the nearest class method.
+Scope = namedtuple('Scope', ['function_name', 'function', 'unit', 'method'])
+MODULE_SCOPE = Scope(None, None, None, None)
+
+UNIT_TYPES = (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+
+def unit_first_line(node):
+    """First line of a function or class, its decorators included."""
+    return node.decorator_list[0].lineno if node.decorator_list else node.lineno
+
+def unit_roots(collector):
+    """The unit a collector walked, with the methods merged into it if it is a class."""
+    return {collector.root, *collector.complexity.methods.get(collector.root, ())}
+
+class TreeCollector:
+    """
+    Everything one traversal gathers from a tree: the units and their symbols,
+    classes, calls, imports and attribute use, with cyclomatic complexity and
+    Halstead counts. The analyzer collects each module-level function and
+    class, and each method of a module-level class, in a collector of its
+    own (walked as if it stood alone in `module`) and merges them with
+    update(), so the collector of an unchanged unit can be merged again into
+    later analyses instead of walking the unit again.
+    """
+    def __init__(self, module):
+        self.root = None
         self.classes = {}
         self.functions = {}
         self.imports = []
         self.calls = defaultdict(list)
-        self.attach_parents(self.tree)
-        self.visit_ast()
+        # Per-method collections (keyed by the method's FunctionDef node), filled
+        # during the single traversal and reused by CBO and LCOM.
+        self.method_attributes = {}
+        self.method_external_calls = {}
+        self.method_classes = {}
+        self.method_outer = {}
+        self.symbols = SymbolTable()
+        self.class_infos = {}
+        # Inputs for the project call graph: every call with its calling unit,
+        # import bindings, and names used other than as a call target.
+        self.call_sites = []
+        self.call_targets = set()
+        self.import_bindings = []
+        self.references = set()
+        # Cyclomatic complexity and Halstead counts are taken during the
+        # traversal.
+        self.complexity = ComplexityCounter(module)
+        self.halstead = HalsteadCounter(module)
 
-    def attach_parents(self, node, parent=None):
-        node.parent = parent
-        for child in ast.iter_child_nodes(node):
-            self.attach_parents(child, node)
-
-    def visit_ast(self):
-        for node in ast.walk(self.tree):
+    def visit_ast(self, root, skip=frozenset()):
+        # One breadth-first pass over the tree (the same order as ast.walk)
+        # collects everything the metrics need. Each queued node carries the
+        # scope it sits in, so collectors attribute calls and attributes in
+        # O(1) without parent links or climbing the tree, and deeply nested
+        # code cannot exhaust the Python stack. Units in `skip` are collected
+        # on their own and left out here.
+        self.root = root
+        todo = deque([(root, MODULE_SCOPE, self.complexity.tree, self.halstead.tree)])
+        while todo:
+            node, scope, cc_owner, halstead_owner = todo.popleft()
+            if node in skip:
+                continue
+            self.complexity.count(node, cc_owner)
+            self.halstead.count(node, halstead_owner)
+            if isinstance(node, UNIT_TYPES):
+                self.register_unit(node, scope)
             if isinstance(node, ast.ClassDef):
-                self.process_class(node)
+                self.process_class(node, scope)
             elif isinstance(node, ast.FunctionDef):
                 self.process_function(node)
             elif isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
                 self.process_import(node)
             elif isinstance(node, ast.Call):
-                self.process_call(node)
+                self.process_call(node, scope)
+            elif isinstance(node, ast.Attribute):
+                self.process_attribute(node, scope)
+            elif isinstance(node, ast.Name):
+                self.process_name(node)
+            child_scope = self.enter_scope(node, scope)
+            # The counters decide which block owns each child (function
+            # headers belong to neither, for instance).
+            todo.extend((child, child_scope, cc_child, halstead_child)
+                        for (child, cc_child), (_, halstead_child) in zip(
+                            self.complexity.child_owners(node, cc_owner),
+                            self.halstead.child_owners(node, halstead_owner)))
+
+    def finish(self):
+        # Once the traversal, and any merge of methods collected on their
+        # own, is done.
+        self.propagate_method_sets()
+        self.freeze_symbols()
+
+    def enter_scope(self, node, scope):
+        """The scope seen by the children of `node`."""
+        if node not in self.symbols:
+            return scope
+        return Scope(
+            node.name if isinstance(node, ast.FunctionDef) else scope.function_name,
+            scope.function if isinstance(node, ast.ClassDef) else node,
+            node,
+            node if node in self.method_attributes else scope.method
+        )
 
-    def process_class(self, node):
+    def propagate_method_sets(self):
+        # The traversal only records into the innermost method. A method also
+        # owns what its nested methods use, so fold each method into the one
+        # enclosing it; registration is breadth-first, so going backwards
+        # handles inner methods before outer ones.
+        for method_node in reversed(list(self.method_attributes)):
+            outer = self.method_outer[method_node]
+            if outer is not None:
+                self.method_attributes[outer] |= self.method_attributes[method_node]
+                self.method_external_calls[outer] |= self.method_external_calls[method_node]
+            self.method_classes[method_node]['attributes'] |= self.method_attributes[method_node]
+
+    def register_unit(self, node, scope):
+        parent_unit = scope.unit
+        if parent_unit is None:
+            qualified_name = node.name
+        else:
+            qualified_name = f"{self.symbols[parent_unit]['qualified_name']}.{node.name}"
+        if isinstance(node, ast.ClassDef):
+            unit_type = 'class'
+        elif parent_unit is not None and isinstance(parent_unit, ast.ClassDef):
+            unit_type = 'method'
+        else:
+            unit_type = 'function'
+        self.symbols.add(node, qualified_name, unit_type, parent_unit)
+
+    def freeze_symbols(self):
+        # The traversal accumulates into mutable sets; metrics read frozen
+        # copies through the symbol table.
+        for method_node, attributes in self.method_attributes.items():
+            symbol = self.symbols[method_node]
+            symbol['attributes'] = frozenset(attributes)
+            symbol['external_calls'] = frozenset(self.method_external_calls[method_node])
+        for class_node, cls_info in self.class_infos.items():
+            self.symbols[class_node]['attributes'] = frozenset(cls_info['attributes'])
+
+    def process_class(self, node, scope):
         bases = [base.id if isinstance(base, ast.Name) else None for base in node.bases]
-        self.classes[node.name] = {
+        cls_info = {
             'node': node,
             'methods': [],
             'bases': bases,
             'attributes': set()
         }
+        self.classes[node.name] = cls_info
+        self.class_infos[node] = cls_info
         for body_item in node.body:
             if isinstance(body_item, ast.FunctionDef):
-                self.classes[node.name]['methods'].append(body_item.name)
-                attr_visitor = AttributeVisitor()
-                attr_visitor.visit(body_item)
-                self.classes[node.name]['attributes'].update(attr_visitor.attributes)
+                cls_info['methods'].append(body_item.name)
+                self.symbols[node]['methods'].setdefault(body_item.name, body_item)
+                self.track_method(body_item, cls_info, scope.method)
+
+    def track_method(self, node, cls_info, outer):
+        self.method_attributes[node] = set()
+        self.method_external_calls[node] = set()
+        self.method_classes[node] = cls_info
+        self.method_outer[node] = outer
 
     def process_function(self, node):
         self.functions[node.name] = node
@@ -59,123 +309,363 @@ class CodeMetricsAnalyzer:
         if isinstance(node, ast.Import):
             for alias in node.names:
                 self.imports.append(alias.name)
+                if alias.asname:
+                    self.import_bindings.append([alias.asname, alias.name, None, 0])
+                else:
+                    top = alias.name.split('.')[0]
+                    self.import_bindings.append([top, top, None, 0])
         elif isinstance(node, ast.ImportFrom):
             module = node.module
             for alias in node.names:
                 self.imports.append(f"{module}.{alias.name}")
+                if alias.name != '*':
+                    self.import_bindings.append([alias.asname or alias.name, module, alias.name, node.level])
 
-    def process_call(self, node):
+    def process_call(self, node, scope):
+        if scope.function is not None:
+            self.symbols[scope.function]['fan_out'] += 1
+        # Children are visited after the call, so its target is known to be
+        # a call target by the time process_name/process_attribute see it.
+        self.call_targets.add(node.func)
+        callee = dotted_name(node.func)
+        if callee is not None:
+            self.call_sites.append((scope.function, callee))
         if isinstance(node.func, ast.Name):
             func_name = node.func.id
-            current_func = self.get_current_function(node)
-            if current_func:
-                self.calls[current_func].append(func_name)
-
-    def get_current_function(self, node):
-        while node:
-            if isinstance(node, ast.FunctionDef):
-                return node.name
-            node = node.parent
-        return None
+            if scope.function_name:
+                self.calls[scope.function_name].append(func_name)
+            if scope.method is not None:
+                self.method_external_calls[scope.method].add(func_name)
+        elif isinstance(node.func, ast.Attribute):
+            if scope.method is not None:
+                self.method_external_calls[scope.method].add(node.func.attr)
+
+    def process_attribute(self, node, scope):
+        if node not in self.call_targets:
+            self.references.add(node.attr)
+        if isinstance(node.value, ast.Name) and node.value.id == 'self':
+            if scope.method is not None:
+                self.method_attributes[scope.method].add(node.attr)
+
+    def process_name(self, node):
+        if isinstance(node.ctx, ast.Load) and node not in self.call_targets:
+            self.references.add(node.id)
+
+    def update(self, other, line_offset=0, parent=None):
+        """
+        Merge in the collector of part of this tree collected on its own: the
+        module's own code, a module-level function or class, or a method of
+        `parent`, a class of this collector. The part has moved down
+        `line_offset` lines since.
+        """
+        self.symbols.update(other.symbols, line_offset, parent)
+        self.classes.update(other.classes)
+        self.class_infos.update(other.class_infos)
+        self.functions.update(other.functions)
+        self.imports.extend(other.imports)
+        for function_name, calls in other.calls.items():
+            self.calls[function_name].extend(calls)
+        self.call_sites.extend(other.call_sites)
+        self.import_bindings.extend(other.import_bindings)
+        self.references |= other.references
+        self.complexity.update(other.complexity, parent)
+        self.halstead.update(other.halstead)
+        if other.root in self.method_attributes:
+            # A method of `parent`: what it uses is the class's on finish().
+            self.method_attributes[other.root] |= other.method_attributes[other.root]
+            self.method_external_calls[other.root] |= other.method_external_calls[other.root]
+
+class CodeMetricsAnalyzer(TreeCollector):
+    def __init__(self, filepath, code=None, mi_variant=DEFAULT_MI_VARIANT, unit_cache=None):
+        if code is None:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                code = f.read()
+        self.source = ParsedSource(code)
+        self.code = self.source.code
+        self.tree = self.source.tree
+        self.lines = self.source.lines
+        self.filepath = filepath
+        super().__init__(self.tree)
+        self.inheritance = None
+        self.mi_variant = mi_variant
+        # Optional UnitCache (see metrics_cache.py): collectors and line
+        # classifications of units seen before are taken from it instead of
+        # being computed again.
+        self.unit_cache = unit_cache
+        self.used_roots = set()
+        # Lines are counted first, from the tree as parsed: collecting may put
+        # cached nodes, with their old line numbers, into it.
+        self.count_lines()
+        # The module's own code is collected like one more unit and merged
+        # last, so that (as in a walk of the whole tree) the module-level
+        # functions and classes come before those defined under an `if` or
+        # `try` at module level.
+        units = [node for node in self.tree.body if isinstance(node, UNIT_TYPES)]
+        module = TreeCollector(self.tree)
+        module.visit_ast(self.tree, set(units))
+        module.finish()
+        for node in units:
+            self.update(*self.collect('unit', node))
+        self.update(module)
+
+    def unit_key(self, kind, node):
+        # A unit is fingerprinted by its source lines, decorators included,
+        # which parse to the same subtree wherever they sit, so a cached
+        # collector only needs its line numbers shifted.
+        if self.unit_cache is None:
+            return None
+        return (kind, self.source.digest(unit_first_line(node), node.end_lineno))
+
+    def collect(self, kind, node):
+        """
+        (collector, line offset) of a module-level function or class ('unit')
+        or of a method of a module-level class ('method'), taken from the unit
+        cache when the same lines were collected before.
+        """
+        first = unit_first_line(node)
+        key = self.unit_key(kind, node)
+        cached = self.unit_cache.get(key) if key else None
+        if cached is not None:
+            origin, collector = cached
+            # A unit repeated verbatim within the file is collected again, as
+            # the cached nodes are already in use.
+            roots = unit_roots(collector)
+            if not roots & self.used_roots:
+                self.used_roots |= roots
+                return collector, first - origin
+        collector = TreeCollector(ast.Module(body=[], type_ignores=[]))
+        if isinstance(node, ast.ClassDef):
+            self.collect_class(collector, node)
+        else:
+            if kind == 'method' and isinstance(node, ast.FunctionDef):
+                # As process_class() sets up the methods it finds.
+                collector.track_method(node, {'attributes': set()}, None)
+            collector.visit_ast(node)
+        collector.finish()
+        if key:
+            self.unit_cache.put(key, (first, collector))
+        self.used_roots |= unit_roots(collector)
+        return collector, 0
+
+    def collect_class(self, collector, node):
+        # Methods are collected on their own. A cached method's node replaces
+        # the freshly parsed one in the class body, so the class links to the
+        # nodes its collector holds.
+        methods = []
+        for i, child in enumerate(node.body):
+            if isinstance(child, FUNCTION_TYPES):
+                method, line_offset = self.collect('method', child)
+                node.body[i] = method.root
+                methods.append((method, line_offset))
+        collector.visit_ast(node, {method.root for method, _ in methods})
+        for method, line_offset in methods:
+            collector.update(method, line_offset, node)
+
+    def line_units(self):
+        # The units collected on their own, in file order.
+        for node in self.tree.body:
+            if isinstance(node, ast.ClassDef):
+                yield from (child for child in node.body if isinstance(child, FUNCTION_TYPES))
+            elif isinstance(node, FUNCTION_TYPES):
+                yield node
+
+    def count_lines(self):
+        # Lines are classified in segments, one per function or method
+        # collected on its own and one per stretch of lines between them,
+        # each tokenized on its own and so reusable while it is unchanged.
+        # The counts of the file and of any unit are read from the segments.
+        # Should a segment not tokenize on its own, the file is classified in
+        # one piece.
+        rows = len(self.source.physical_lines)
+        bounds = []
+        row = 1
+        for node in self.line_units():
+            first = unit_first_line(node)
+            if row < first:
+                bounds.append((row, first - 1))
+            bounds.append((first, node.end_lineno))
+            row = node.end_lineno + 1
+        if row <= rows:
+            bounds.append((row, rows))
+        try:
+            segments = [(first, self.classify_lines(first, last)) for first, last in bounds]
+        except (tokenize.TokenError, SyntaxError):
+            segments = [(1, self.classify_lines(1, rows))]
+        self.line_classifier = SegmentedClassifier(segments, len(self.lines))
+        self.line_counts = self.line_classifier.counts()
+
+    def classify_lines(self, first, last):
+        key = ('lines', self.source.digest(first, last)) if self.unit_cache is not None else None
+        classifier = self.unit_cache.get(key) if key else None
+        if classifier is None:
+            classifier = LineClassifier(self.source.logical_lines(first, last), last - first + 1)
+            if key:
+                self.unit_cache.put(key, classifier)
+        return classifier
+
+    def unit_line_counts(self, unit):
+        return self.line_classifier.counts(*unit['lines'])
+
+    def calculate_project_summary(self):
+        """
+        What the project call graph and class hierarchy need from this file,
+        as plain JSON: the units it defines (classes with their dotted base
+        names), its import bindings as [local name, module, name, level],
+        calls as [calling unit (None at module level), dotted callee, count],
+        and the names it uses other than as call targets.
+        """
+        definitions = {}
+        for node, unit in self.symbols.items():
+            definition = definitions.setdefault(unit['qualified_name'], {
+                'type': unit['type'],
+                'lines': list(unit['lines']),
+                'decorated': bool(node.decorator_list)
+            })
+            if unit['type'] == 'class' and definition['lines'] == list(unit['lines']):
+                definition['bases'] = [name for name in map(dotted_name, node.bases) if name]
+        call_counts = defaultdict(int)
+        for caller, callee in self.call_sites:
+            call_counts[(self.symbols[caller]['qualified_name'] if caller else None, callee)] += 1
+        return {
+            'definitions': definitions,
+            'imports': self.import_bindings,
+            'calls': [[caller, callee, count] for (caller, callee), count in call_counts.items()],
+            'references': sorted(self.references)
+        }
 
     def calculate_LOC(self):
-        code_lines = [line for line in self.lines if line.strip()]
-        return len(code_lines)
+        """Non-blank physical lines."""
+        return self.line_counts['physical'] - self.line_counts['blank']
 
     def calculate_comment_density(self):
-        comment_lines = [line for line in self.lines if line.strip().startswith('#')]
-        code_lines = [line for line in self.lines if line.strip() and not line.strip().startswith('#')]
-        return len(comment_lines) / len(code_lines) if code_lines else 0
+        """Comment and docstring lines per source line."""
+        counts = self.line_counts
+        return (counts['comment'] + counts['docstring']) / counts['source'] if counts['source'] else 0
 
     def calculate_cyclomatic_complexity(self):
-        complexities = cc_visit(self.code)
-        total_complexity = sum([block.complexity for block in complexities])
-        return total_complexity
+        return self.complexity.blocks_total()
 
     def calculate_halstead_metrics(self):
-        halstead_metrics = h_visit(self.code)
-        total = halstead_metrics.total
-        return {
-            'unique_operators': total.h1,
-            'unique_operands': total.h2,
-            'total_operators': total.N1,
-            'total_operands': total.N2,
-            'volume': total.volume,
-            'effort': total.effort
-        }
+        return self.halstead.module_counts().report()
 
     def calculate_maintainability_index(self):
-        return mi_visit(self.code, multi=False) or 0
+        return self.maintainability_index(
+            self.halstead.module_counts().report()['volume'],
+            self.complexity.total_complexity(),
+            self.line_counts
+        ) or 0
+
+    def maintainability_index(self, volume, complexity, line_counts):
+        # As in radon, the comment percentage is taken over source lines and
+        # logical lines stand for the LOC term.
+        source = line_counts['source']
+        comments = line_counts['comment'] / float(source) * 100 if source != 0 else 0
+        return maintainability_index(volume, complexity, line_counts['logical'], comments, self.mi_variant)
 
     def calculate_DIT(self):
-        inheritance_depths = [
-            self.get_inheritance_depth(cls['node']) for cls in self.classes.values()
-        ]
-        return max(inheritance_depths, default=0)
-
-    def get_inheritance_depth(self, node, depth=0):
-        if not node.bases:
-            return depth
-        max_depth = depth
-        for base in node.bases:
-            if isinstance(base, ast.Name):
-                base_name = base.id
-                if base_name in self.classes:
-                    base_node = self.classes[base_name]['node']
-                    max_depth = max(max_depth, self.get_inheritance_depth(base_node, depth + 1))
-        return max_depth
+        depths, _ = self.calculate_inheritance()
+        return max((depths[cls['node']] for cls in self.classes.values()), default=0)
+
+    def calculate_inheritance(self):
+        """
+        (DIT, NOC) dicts keyed by class node. Bases are resolved by name within
+        this file, where the last class of a name wins; see
+        inheritance_depths() for how cycles are handled.
+        """
+        if self.inheritance is None:
+            bases = {
+                node: [self.classes[name]['node'] for name in cls_info['bases'] if name in self.classes]
+                for node, cls_info in self.class_infos.items()
+            }
+            self.inheritance = (inheritance_depths(bases), children_counts(bases))
+        return self.inheritance
 
     def calculate_CBO(self):
         coupling = 0
         for cls_info in self.classes.values():
-            methods = cls_info['methods']
-            for method_name in methods:
+            for method_name in cls_info['methods']:
                 method_node = self.get_method_node(cls_info['node'], method_name)
                 if method_node:
-                    external_calls = self.get_external_calls(method_node)
-                    coupling += len(external_calls)
+                    coupling += len(self.get_external_calls(method_node))
         return coupling
 
     def get_method_node(self, class_node, method_name):
-        for body_item in class_node.body:
-            if isinstance(body_item, ast.FunctionDef) and body_item.name == method_name:
-                return body_item
-        return None
+        return self.symbols[class_node]['methods'].get(method_name)
 
     def get_external_calls(self, node):
-        external_calls = set()
-        for child in ast.walk(node):
-            if isinstance(child, ast.Call):
-                if isinstance(child.func, ast.Attribute):
-                    external_calls.add(child.func.attr)
-                elif isinstance(child.func, ast.Name):
-                    external_calls.add(child.func.id)
-        return external_calls
+        return self.symbols[node]['external_calls']
 
     def calculate_LCOM(self):
-        lcom_values = []
-        for cls_info in self.classes.values():
-            methods = cls_info['methods']
-            attributes = cls_info['attributes']
-            method_attr_usage = [
-                self.get_method_attributes(cls_info['node'], method_name) for method_name in methods
-            ]
-            P, Q = 0, 0
-            for i in range(len(method_attr_usage)):
-                for j in range(i + 1, len(method_attr_usage)):
-                    if method_attr_usage[i].intersection(method_attr_usage[j]):
-                        Q += 1
-                    else:
-                        P += 1
-            lcom = max(0, P - Q)
-            lcom_values.append(lcom)
+        lcom_values = [self.calculate_class_LCOM(cls_info) for cls_info in self.classes.values()]
         return sum(lcom_values) / len(lcom_values) if lcom_values else 0
 
+    def calculate_class_LCOM(self, cls_info):
+        return self.calculate_class_cohesion(cls_info)['lcom']
+
+    def calculate_class_cohesion(self, cls_info):
+        """
+        LCOM (P - Q), LCOM4 and LCOM-HS for one class, computed from integer
+        bitsets over the per-method attribute sets collected in visit_ast.
+        """
+        if 'cohesion' in cls_info:
+            return cls_info['cohesion']
+        usage = [
+            self.get_method_attributes(cls_info['node'], method_name) for method_name in cls_info['methods']
+        ]
+
+        # Column bitsets: bit i of attribute_rows[attr] is set when method i
+        # uses attr. A method's neighbours are the OR of its attributes'
+        # columns, so Q (pairs sharing an attribute) needs no pairwise loop.
+        attribute_rows = defaultdict(int)
+        for row, attributes in enumerate(usage):
+            for attribute in attributes:
+                attribute_rows[attribute] |= 1 << row
+        Q = 0
+        for row, attributes in enumerate(usage):
+            neighbours = 0
+            for attribute in attributes:
+                neighbours |= attribute_rows[attribute]
+            Q += bin(neighbours >> (row + 1)).count('1')
+        P = len(usage) * (len(usage) - 1) // 2 - Q
+
+        # LCOM4 and LCOM-HS work on distinct methods and treat self.<method>
+        # references as calls rather than as shared fields.
+        first_rows = {}
+        for row, method_name in enumerate(cls_info['methods']):
+            first_rows.setdefault(method_name, row)
+        names = list(first_rows)
+        index = {name: row for row, name in enumerate(names)}
+        roots = list(range(len(names)))
+
+        def find(row):
+            while roots[row] != row:
+                roots[row] = roots[roots[row]]
+                row = roots[row]
+            return row
+
+        field_rows = defaultdict(int)
+        for row, name in enumerate(names):
+            for attribute in usage[first_rows[name]]:
+                if attribute in index:
+                    roots[find(row)] = find(index[attribute])
+                    continue
+                if field_rows[attribute]:
+                    first_user = (field_rows[attribute] & -field_rows[attribute]).bit_length() - 1
+                    roots[find(row)] = find(first_user)
+                field_rows[attribute] |= 1 << row
+        lcom4 = len({find(row) for row in range(len(names))})
+
+        lcom_hs = 0
+        if len(names) > 1 and field_rows:
+            mean_users = sum(bin(rows).count('1') for rows in field_rows.values()) / len(field_rows)
+            lcom_hs = (mean_users - len(names)) / (1 - len(names))
+
+        cls_info['cohesion'] = {'lcom': max(0, P - Q), 'lcom4': lcom4, 'lcom_hs': lcom_hs}
+        return cls_info['cohesion']
+
     def get_method_attributes(self, class_node, method_name):
         method_node = self.get_method_node(class_node, method_name)
-        attr_visitor = AttributeVisitor()
-        attr_visitor.visit(method_node)
-        return attr_visitor.attributes
+        return self.symbols[method_node]['attributes']
 
     def calculate_FanIn_FanOut(self):
         fan_in = defaultdict(int)
@@ -186,41 +676,178 @@ class CodeMetricsAnalyzer:
                 fan_in[called_func] += 1
         return sum(fan_in.values()), sum(fan_out.values())
 
+    def unit_fan_in(self):
+        """
+        Calls made in this file to each function, method and class. A bare
+        name is counted for the functions and classes of that name. A method
+        is counted only when it is called on `self` or `cls` from within its
+        class, or on its class's name. Calls on other objects cannot be told
+        apart without types and are left to the project call graph.
+        """
+        names = defaultdict(int)
+        methods = defaultdict(int)
+        for caller, callee in self.call_sites:
+            parts = callee.split('.')
+            if len(parts) == 1:
+                names[callee] += 1
+            elif len(parts) == 2:
+                if parts[0] in ('self', 'cls'):
+                    class_node = self.enclosing_class(caller)
+                else:
+                    class_info = self.classes.get(parts[0])
+                    class_node = class_info['node'] if class_info else None
+                if class_node is not None:
+                    method = self.symbols[class_node]['methods'].get(parts[1])
+                    if method is not None:
+                        methods[method] += 1
+        return {node: methods[node] if unit['type'] == 'method' else names[node.name]
+                for node, unit in self.symbols.items()}
+
+    def enclosing_class(self, node):
+        """The class a function is defined in, directly or through enclosing functions."""
+        while node is not None and self.symbols[node]['type'] != 'class':
+            node = self.symbols[node]['parent']
+        return node
+
     def calculate_NOM(self):
         return sum(len(cls_info['methods']) for cls_info in self.classes.values())
 
-class AttributeVisitor(ast.NodeVisitor):
-    def __init__(self):
-        self.attributes = set()
+    def calculate_granular_metrics(self):
+        """
+        Per-function, per-method and per-class metrics keyed by
+        "<qualified name>:<first line>-<last line>". Everything comes from the
+        collections and counters filled during the single traversal; no unit
+        is walked again.
+        """
+        depths, children = self.calculate_inheritance()
+        fan_in = self.unit_fan_in()
 
-    def visit_Attribute(self, node):
-        if isinstance(node.value, ast.Name) and node.value.id == 'self':
-            self.attributes.add(node.attr)
-        self.generic_visit(node)
-
-def calculate_mccall_metrics(metrics):
-    max_values = {
-        'cyclomatic_complexity': 50,
-        'comment_density': 1.0,
-        'maintainability_index': 100,
-        'cbo': 20,
-        'lcom': 100,
-        'fan_in': 50,
-        'fan_out': 50,
-        'loc': 1000,
-        'dit': 10,
-        'effort': 1000
-
-        # max_complexity = 150
-        # max_comment_density = 100
-        # max_mi = 100
-        # max_cbo = 200
-        # max_lcom = 100
-        # max_fan_in = 100
-        # max_fan_out = 100
-        # max_loc = 1000
-        # max_dit = 10
-    }
+        granular = {}
+        for node, unit in self.symbols.items():
+            if unit['type'] == 'class':
+                methods = [self.halstead.function_counts(child) for child in node.body
+                           if self.halstead.function_counts(child) is not None]
+                halstead = HalsteadCounts.merge(methods) if methods else None
+                fan_out = sum(self.symbols[child]['fan_out'] for child in node.body if child in self.symbols
+                              and self.symbols[child]['type'] == 'method')
+            else:
+                halstead = self.halstead.function_counts(node)
+                fan_out = unit['fan_out']
+            halstead = halstead.report() if halstead else None
+            complexity = self.complexity.real_complexity(node)
+            line_counts = self.unit_line_counts(unit)
+            if complexity is None:
+                maintainability = None
+            else:
+                maintainability = self.maintainability_index(
+                    halstead['volume'] if halstead else 0, complexity, line_counts)
+            metrics = {
+                'type': unit['type'],
+                'qualified_name': unit['qualified_name'],
+                'lines': list(unit['lines']),
+                'loc': line_counts['physical'] - line_counts['blank'],
+                'line_counts': line_counts,
+                'cyclomatic_complexity': self.complexity.complexity(node),
+                'halstead_metrics': halstead,
+                'maintainability_index': maintainability,
+                'fan_in': fan_in[node],
+                'fan_out': fan_out
+            }
+            if unit['type'] == 'class':
+                metrics.update(self.calculate_class_cohesion(self.class_infos[node]))
+                metrics['nom'] = len(self.class_infos[node]['methods'])
+                metrics['dit'] = depths[node]
+                metrics['noc'] = children[node]
+            granular[f"{unit['qualified_name']}:{unit['lines'][0]}-{unit['lines'][1]}"] = metrics
+        return dict(sorted(granular.items(), key=lambda item: item[1]['lines']))
+
+def dotted_name(node):
+    """'a.b.c' for a chain of attribute accesses on a name, else None."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return '.'.join(reversed(parts))
+
+def inheritance_depths(bases):
+    """
+    Depth of inheritance for every class, given {class: [resolved bases]}: 0
+    without resolved bases, otherwise one more than the deepest base. Each
+    class is computed once, in a depth-first post-order kept on an explicit
+    stack, so deep hierarchies cannot exhaust the Python stack. A base that
+    leads back to a class still being computed (a cycle, or a shadowed name
+    as in `class A(A)`) is ignored.
+    """
+    depths = {}
+    in_progress = set()
+    for start in bases:
+        if start in depths:
+            continue
+        in_progress.add(start)
+        stack = [(start, iter(bases[start]))]
+        while stack:
+            cls, pending = stack[-1]
+            for base in pending:
+                if base not in depths and base not in in_progress:
+                    in_progress.add(base)
+                    stack.append((base, iter(bases.get(base, ()))))
+                    break
+            else:
+                stack.pop()
+                in_progress.discard(cls)
+                depths[cls] = max((depths[base] + 1 for base in bases.get(cls, ()) if base in depths), default=0)
+    return depths
+
+def children_counts(bases):
+    """Number of direct subclasses (NOC) of every class in `bases`."""
+    children = dict.fromkeys(bases, 0)
+    for cls, parents in bases.items():
+        for base in set(parents):
+            if base != cls and base in children:
+                children[base] += 1
+    return children
+
+MAX_VALUES = {
+    'cyclomatic_complexity': 50,
+    'comment_density': 1.0,
+    'maintainability_index': 100,
+    'cbo': 20,
+    'lcom': 100,
+    'fan_in': 50,
+    'fan_out': 50,
+    'loc': 1000,
+    'dit': 10,
+    'effort': 1000
+
+    # max_complexity = 150
+    # max_comment_density = 100
+    # max_mi = 100
+    # max_cbo = 200
+    # max_lcom = 100
+    # max_fan_in = 100
+    # max_fan_out = 100
+    # max_loc = 1000
+    # max_dit = 10
+}
+
+# The static_metrics entry behind each McCall threshold.
+MCCALL_INPUTS = {
+    'cyclomatic_complexity': "Cyclomatic Complexity",
+    'comment_density': "Comment Density",
+    'maintainability_index': "Maintainability Index",
+    'cbo': "Coupling Between Object classes (CBO)",
+    'lcom': "Lack of Cohesion of Methods (LCOM)",
+    'fan_in': "Fan-in",
+    'fan_out': "Fan-out",
+    'loc': "Lines of Code (LOC)",
+    'dit': "Depth of Inheritance Tree (DIT)",
+    'effort': "Effort"
+}
+
+def calculate_mccall_metrics(metrics, max_values=MAX_VALUES):
     return {
         "Modifiability": 0.4 * (1 - (metrics['cyclomatic_complexity'] / max_values['cyclomatic_complexity'])) +
                         0.3 * (metrics['comment_density'] / max_values['comment_density']) +
@@ -246,54 +873,194 @@ def calculate_mccall_metrics(metrics):
                     ), 1)),
     }
 
-if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python code_metrics_integrated.py <filepath>")
-        sys.exit(1)
-    filepath = sys.argv[1]
-    analyzer = CodeMetricsAnalyzer(filepath)
-    
+def analyze_code(filepath, parse_stats=None, code=None, granular=False, project_summary=False,
+                 halstead_counts=False, mi_variant=DEFAULT_MI_VARIANT, max_values=MAX_VALUES, unit_cache=None):
+    analyzer = CodeMetricsAnalyzer(filepath, code, mi_variant, unit_cache)
+    if parse_stats is not None:
+        parse_stats.update(analyzer.source.parse_stats())
+
+    # Every metric is computed exactly once and shared by both output blocks.
+    loc = analyzer.calculate_LOC()
+    line_counts = analyzer.line_counts
+    comment_density = analyzer.calculate_comment_density()
+    cyclomatic_complexity = analyzer.calculate_cyclomatic_complexity()
+    maintainability_index = analyzer.calculate_maintainability_index()
     halstead_metrics = analyzer.calculate_halstead_metrics()
+    dit = analyzer.calculate_DIT()
+    cbo = analyzer.calculate_CBO()
+    lcom = analyzer.calculate_LCOM()
+    fan_in, fan_out = analyzer.calculate_FanIn_FanOut()
+    nom = analyzer.calculate_NOM()
+
     metrics_unformatted = {
-        "cyclomatic_complexity": analyzer.calculate_cyclomatic_complexity(),
-        "comment_density": analyzer.calculate_comment_density(),
-        "maintainability_index": analyzer.calculate_maintainability_index(),
-        "cbo": analyzer.calculate_CBO(),
-        "lcom": analyzer.calculate_LCOM(),
+        "cyclomatic_complexity": cyclomatic_complexity,
+        "comment_density": comment_density,
+        "maintainability_index": maintainability_index,
+        "cbo": cbo,
+        "lcom": lcom,
         "halstead_metrics": halstead_metrics,
-        "fan_in": analyzer.calculate_FanIn_FanOut()[0],
-        "fan_out": analyzer.calculate_FanIn_FanOut()[1],
-        "loc": analyzer.calculate_LOC(),
-        "dit": analyzer.calculate_DIT()
+        "fan_in": fan_in,
+        "fan_out": fan_out,
+        "loc": loc,
+        "dit": dit
     }
 
     metrics = {
-        "Lines of Code (LOC)": analyzer.calculate_LOC(),
-        "Comment Density": analyzer.calculate_comment_density(),
-        "Cyclomatic Complexity": analyzer.calculate_cyclomatic_complexity(),
-        "Maintainability Index": analyzer.calculate_maintainability_index(),
+        "Lines of Code (LOC)": loc,
+        "Logical Lines of Code (LLOC)": line_counts['logical'],
+        "Source Lines of Code (SLOC)": line_counts['source'],
+        "Comment Lines": line_counts['comment'],
+        "Docstring Lines": line_counts['docstring'],
+        "Blank Lines": line_counts['blank'],
+        "Comment Density": comment_density,
+        "Cyclomatic Complexity": cyclomatic_complexity,
+        "Maintainability Index": maintainability_index,
         "Halstead Metrics": "",
         "Unique Operators": halstead_metrics['unique_operators'],
         "Unique Operands": halstead_metrics['unique_operands'],
         "Total Operators": halstead_metrics['total_operators'],
         "Total Operands": halstead_metrics['total_operands'],
         "Volume": halstead_metrics['volume'],
+        "Difficulty": halstead_metrics['difficulty'],
         "Effort": halstead_metrics['effort'],
-        "Depth of Inheritance Tree (DIT)": analyzer.calculate_DIT(),
-        "Coupling Between Object classes (CBO)": analyzer.calculate_CBO(),
-        "Lack of Cohesion of Methods (LCOM)": analyzer.calculate_LCOM(),
-        "Fan-in": analyzer.calculate_FanIn_FanOut()[0],
-        "Fan-out": analyzer.calculate_FanIn_FanOut()[1],
-        "Number of Methods (NOM)": analyzer.calculate_NOM()
+        "Time": halstead_metrics['time'],
+        "Bugs": halstead_metrics['bugs'],
+        "Depth of Inheritance Tree (DIT)": dit,
+        "Coupling Between Object classes (CBO)": cbo,
+        "Lack of Cohesion of Methods (LCOM)": lcom,
+        "Fan-in": fan_in,
+        "Fan-out": fan_out,
+        "Number of Methods (NOM)": nom
     }
-    mccall_metrics = calculate_mccall_metrics(metrics_unformatted)
+    mccall_metrics = calculate_mccall_metrics(metrics_unformatted, max_values)
     combined_metrics = {
         'static_metrics': metrics,
         'intermediate_level_metrics': mccall_metrics
     }
+    if granular:
+        combined_metrics['granular_metrics'] = analyzer.calculate_granular_metrics()
+    if project_summary:
+        combined_metrics['project_summary'] = analyzer.calculate_project_summary()
+    if halstead_counts:
+        # Raw counts, so project mode can merge files into package-level
+        # Halstead metrics.
+        combined_metrics['halstead_counts'] = analyzer.halstead.module_counts().to_json()
+    return combined_metrics
+
+def analyze_single_file(filepath, cache=None, granular=False, mi_variant=DEFAULT_MI_VARIANT,
+                        max_values=MAX_VALUES):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        code = f.read()
+    parse_stats = {}
+    key = cache.key(code) if cache else None
+    combined_metrics = cache.get(key) if cache else None
+    if combined_metrics is None:
+        combined_metrics = analyze_code(filepath, parse_stats, code, granular, mi_variant=mi_variant,
+                                        max_values=max_values)
+        if cache:
+            cache.put(key, combined_metrics)
 
     output_filename = f"{filepath[:-3]}_metrics.json"
     with open(output_filename, 'w') as f:
         json.dump(combined_metrics, f, indent=4)
     print(f"Metrics saved to '{output_filename}'.")
+    if not parse_stats:
+        print("Source unchanged since last run: metrics served from cache.")
+    else:
+        print(f"Parsed once, tokenized once: {parse_stats['parses_avoided']} parses and "
+              f"{parse_stats['tokenizations_avoided']} tokenization avoided "
+              f"(~{parse_stats['time_saved'] * 1000:.2f} ms saved).")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute static code metrics and McCall quality attributes.")
+    parser.add_argument('target', help="Python file, directory or glob pattern to analyze")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes for project mode (default: available cores)")
+    parser.add_argument('--timeout', type=float, default=60,
+                        help="per-file timeout in seconds for project mode")
+    parser.add_argument('--output', default='project_metrics.json',
+                        help="project report path for project mode")
+    parser.add_argument('--cache-dir', default='.insightify_cache',
+                        help="directory holding the persistent metrics cache")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="recompute every file and leave the cache untouched")
+    parser.add_argument('--granular', action='store_true',
+                        help="also report metrics per function, method and class")
+    parser.add_argument('--call-graph', action='store_true',
+                        help="project mode: build the cross-file call graph (requires networkx)")
+    parser.add_argument('--hierarchy', action='store_true',
+                        help="project mode: resolve the class hierarchy across modules (DIT and NOC per class)")
+    parser.add_argument('--base', default=None,
+                        help="project mode: git revision to diff against; report before/after "
+                             "metrics of the changed files and functions (implies --granular)")
+    parser.add_argument('--mi-variant', choices=MI_VARIANTS, default=DEFAULT_MI_VARIANT,
+                        help="Maintainability Index formula: 'sei' (with the comment term, as radon) "
+                             "or 'vs' (Visual Studio, without it)")
+    parser.add_argument('--thresholds', default=None,
+                        help="thresholds profile (from --calibrate) to normalize the McCall attributes with")
+    parser.add_argument('--calibrate', default=None, metavar='PROFILE',
+                        help="project mode: derive McCall thresholds from the analyzed corpus and save them "
+                             "as a profile")
+    parser.add_argument('--quantile', type=float, default=None,
+                        help="with --calibrate: corpus quantile taken as each metric's maximum (default: 0.95)")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and re-analyze files as they change, reporting metric changes "
+                             "(implies --granular)")
+    parser.add_argument('--debounce', type=float, default=0.3,
+                        help="with --watch: seconds without further saves before re-analyzing")
+    parser.add_argument('--jsonl', default=None,
+                        help="with --watch: append each batch of changes to this JSON Lines file "
+                             "instead of printing it")
+    parser.add_argument('--poll', action='store_true',
+                        help="with --watch: poll for changes instead of using inotify")
+    args = parser.parse_args()
+    if args.base or args.watch:
+        args.granular = True
+    max_values = MAX_VALUES
+    if args.thresholds:
+        from thresholds import load_thresholds
+        max_values = load_thresholds(args.thresholds)
+
+    project_mode = args.base or args.watch or not os.path.isfile(args.target)
 
+    # Watch mode builds neither the call graph nor the class hierarchy, so its
+    # results carry no project summaries and are cached under that config.
+    project_summary = (args.call_graph or args.hierarchy) and not args.watch
+    cache = None
+    if not args.no_cache:
+        from metrics_cache import MetricsCache
+        cache = MetricsCache(args.cache_dir, max_values=max_values, granular=args.granular,
+                             project_summary=project_summary,
+                             halstead_counts=project_mode, mi_variant=args.mi_variant)
+    try:
+        if args.watch:
+            from watch import watch
+            options = {'granular': args.granular, 'mi_variant': args.mi_variant, 'max_values': max_values}
+            watch(args.target, cache, options, args.debounce, args.jsonl, args.poll, args.workers, args.timeout)
+        elif not project_mode:
+            analyze_single_file(args.target, cache, args.granular, args.mi_variant, max_values)
+        else:
+            from project_metrics import analyze_project, write_project_report
+            sinks = ()
+            if args.calibrate:
+                # The sketches take each file's metrics as its analysis
+                # finishes.
+                from thresholds import MetricSketches
+                sketches = MetricSketches()
+                sinks = (sketches,)
+            report = analyze_project(args.target, args.workers, args.timeout, cache,
+                                     args.granular, args.call_graph, args.hierarchy, args.base,
+                                     args.mi_variant, max_values, sinks)
+            write_project_report(report, args.output)
+            if args.calibrate:
+                from thresholds import DEFAULT_QUANTILE, write_profile
+                quantile = args.quantile if args.quantile is not None else DEFAULT_QUANTILE
+                profile = write_profile(sketches, args.calibrate, quantile)
+                print(f"Thresholds from {profile['files']} files at the {quantile:g} quantile "
+                      f"saved to '{args.calibrate}'.")
+    finally:
+        if cache:
+            cache.close()
+
+if __name__ == '__main__':
+    main()
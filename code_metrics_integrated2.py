@@ -4,7 +4,7 @@ import json
 from radon.complexity import cc_visit
 from radon.metrics import h_visit, mi_visit
 from radon.visitors import HalsteadVisitor
-from collections import defaultdict
+from collections import defaultdict, deque
 import networkx as nx
 import sys
 
@@ -20,21 +20,16 @@ class CodeMetricsAnalyzer:
         self.imports = []
         self.calls = defaultdict(list)
 
-        # Set parent attributes for all AST nodes
-        self.attach_parents(self.tree)
-
         self.visit_ast()
 
-    def attach_parents(self, node, parent=None):
-        """
-        Recursively attach a 'parent' attribute to each node in the AST.
-        """
-        node.parent = parent
-        for child in ast.iter_child_nodes(node):
-            self.attach_parents(child, node)
-
     def visit_ast(self):
-        for node in ast.walk(self.tree):
+        # Breadth-first like ast.walk, but each queued node carries the name of
+        # the function it sits in, so calls are attributed without parent links.
+        todo = deque([(self.tree, None)])
+        while todo:
+            node, current_func = todo.popleft()
+            child_func = node.name if isinstance(node, ast.FunctionDef) else current_func
+            todo.extend((child, child_func) for child in ast.iter_child_nodes(node))
             if isinstance(node, ast.ClassDef):
                 self.process_class(node)
             elif isinstance(node, ast.FunctionDef):
@@ -42,19 +37,21 @@ class CodeMetricsAnalyzer:
             elif isinstance(node, (ast.Import, ast.ImportFrom)):
                 self.process_import(node)
             elif isinstance(node, ast.Call):
-                self.process_call(node)
+                self.process_call(node, current_func)
 
     def process_class(self, node):
         bases = [base.id if isinstance(base, ast.Name) else None for base in node.bases]
         self.classes[node.name] = {
             'node': node,
             'methods': [],
+            'method_nodes': {},
             'bases': bases,
             'attributes': set()
         }
         for body_item in node.body:
             if isinstance(body_item, ast.FunctionDef):
                 self.classes[node.name]['methods'].append(body_item.name)
+                self.classes[node.name]['method_nodes'].setdefault(body_item.name, body_item)
                 attr_visitor = AttributeVisitor()
                 attr_visitor.visit(body_item)
                 self.classes[node.name]['attributes'].update(attr_visitor.attributes)
@@ -71,20 +68,12 @@ class CodeMetricsAnalyzer:
             for alias in node.names:
                 self.imports.append(f"{module}.{alias.name}")
 
-    def process_call(self, node):
+    def process_call(self, node, current_func):
         if isinstance(node.func, ast.Name):
             func_name = node.func.id
-            current_func = self.get_current_function(node)
             if current_func:
                 self.calls[current_func].append(func_name)
 
-    def get_current_function(self, node):
-        while node:
-            if isinstance(node, ast.FunctionDef):
-                return node.name
-            node = node.parent
-        return None
-
     def calculate_LOC(self):
         code_lines = [line for line in self.lines if line.strip()]
         return len(code_lines)
@@ -143,10 +132,7 @@ class CodeMetricsAnalyzer:
         return coupling
 
     def get_method_node(self, class_node, method_name):
-        for body_item in class_node.body:
-            if isinstance(body_item, ast.FunctionDef) and body_item.name == method_name:
-                return body_item
-        return None
+        return self.classes[class_node.name]['method_nodes'].get(method_name)
 
     def get_external_calls(self, node, class_name):
         external_calls = set()
@@ -157,7 +143,7 @@ class CodeMetricsAnalyzer:
                         external_calls.add(child.func.attr)
                 elif isinstance(child.func, ast.Name):
                     func_name = child.func.id
-                    if func_name not in self.classes[class_name]['methods']:
+                    if func_name not in self.classes[class_name]['method_nodes']:
                         external_calls.add(func_name)
         return external_calls
 
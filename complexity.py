@@ -0,0 +1,163 @@
+import ast
+from collections import defaultdict, deque
+
+FUNCTION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef)
+TRY_TYPES = (ast.Try, ast.TryStar) if hasattr(ast, 'TryStar') else (ast.Try,)
+
+def match_decisions(node):
+    # An irrefutable `case _:` / `case name:` is the fallthrough, not a branch.
+    fallthrough = any(isinstance(case.pattern, ast.MatchAs) and case.pattern.pattern is None
+                      for case in node.cases)
+    return max(0, len(node.cases) - fallthrough)
+
+# Decision points each node type adds to the block that owns it.
+DECISION_RULES = {
+    ast.If: lambda node: 1,
+    ast.IfExp: lambda node: 1,
+    ast.Assert: lambda node: 1,
+    ast.BoolOp: lambda node: len(node.values) - 1,
+    ast.For: lambda node: 1 + bool(node.orelse),
+    ast.AsyncFor: lambda node: 1 + bool(node.orelse),
+    ast.While: lambda node: 1 + bool(node.orelse),
+    ast.comprehension: lambda node: 1 + len(node.ifs),
+}
+for try_type in TRY_TYPES:
+    DECISION_RULES[try_type] = lambda node: len(node.handlers) + bool(node.orelse)
+if hasattr(ast, 'Match'):
+    DECISION_RULES[ast.Match] = match_decisions
+
+class ComplexityCounter:
+    """
+    Cyclomatic complexity of a module and of each function, method and class
+    in it, following radon's rules so the numbers stay comparable: decision
+    points are counted for the innermost function or class whose body holds
+    them, decorators, defaults and bases are not counted, an assert counts
+    once without looking inside it, and classes defined inside functions are
+    left out. Unlike radon, `try/except*` is counted like `try/except`.
+
+    A traversal feeds nodes through count() with the owner returned by
+    child_owners(), so the counter can share a walk of the tree with other
+    collectors; from_tree() runs a walk of its own.
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        self.decisions = defaultdict(int)
+        self.owners = {}
+        self.methods = defaultdict(list)
+
+    @classmethod
+    def from_tree(cls, tree):
+        counter = cls(tree)
+        todo = deque([(tree, tree)])
+        while todo:
+            node, owner = todo.popleft()
+            counter.count(node, owner)
+            todo.extend(counter.child_owners(node, owner))
+        return counter
+
+    def count(self, node, owner):
+        if owner is None:
+            return
+        rule = DECISION_RULES.get(type(node))
+        if rule is not None:
+            self.decisions[owner] += rule(node)
+        if isinstance(node, FUNCTION_TYPES) or isinstance(node, ast.ClassDef):
+            self.owners[node] = owner
+            if isinstance(node, FUNCTION_TYPES) and isinstance(owner, ast.ClassDef):
+                self.methods[owner].append(node)
+
+    def update(self, other, owner=None):
+        """
+        Take in a counter that walked one function or class of this module on
+        its own, with its own `tree` standing in for the block around it:
+        `owner` (the class of a method) or else this module.
+        """
+        owner = self.tree if owner is None else owner
+        for block, decisions in other.decisions.items():
+            self.decisions[owner if block is other.tree else block] += decisions
+        for node, block in other.owners.items():
+            if block is other.tree:
+                block = owner
+                if isinstance(node, FUNCTION_TYPES) and isinstance(owner, ast.ClassDef):
+                    self.methods[owner].append(node)
+            self.owners[node] = block
+        self.methods.update(other.methods)
+
+    def child_owners(self, node, owner):
+        """(child, owner) pairs for the children of `node`."""
+        children = ast.iter_child_nodes(node)
+        if owner is None or isinstance(node, ast.Assert):
+            return ((child, None) for child in children)
+        if isinstance(node, FUNCTION_TYPES) or isinstance(node, ast.ClassDef):
+            if isinstance(node, ast.ClassDef) and isinstance(owner, FUNCTION_TYPES):
+                return ((child, None) for child in children)
+            # Only the body belongs to the block; the header (decorators,
+            # arguments, bases) is not counted anywhere.
+            return ((child, node if isinstance(child, ast.stmt) else None) for child in children)
+        return ((child, owner) for child in children)
+
+    def is_counted(self, node):
+        return node in self.owners and not (isinstance(node, ast.ClassDef)
+                                            and isinstance(self.owners[node], FUNCTION_TYPES))
+
+    def function_complexity(self, node):
+        return 1 + self.decisions[node]
+
+    def class_real_complexity(self, node):
+        return 1 + self.decisions[node] + sum(map(self.function_complexity, self.methods[node]))
+
+    def complexity(self, node):
+        """
+        Complexity of a function, method or class (for a class, the average
+        over its methods plus one, as radon reports it); None for units radon
+        does not report.
+        """
+        if not self.is_counted(node):
+            return None
+        if isinstance(node, FUNCTION_TYPES):
+            return self.function_complexity(node)
+        methods = len(self.methods[node])
+        if not methods:
+            return self.class_real_complexity(node)
+        return int(self.class_real_complexity(node) / methods) + (methods > 1)
+
+    def real_complexity(self, node):
+        """
+        Complexity of a function, or of a class and all its methods, the
+        same figure total_complexity() adds up per unit; None for units radon
+        does not report.
+        """
+        if not self.is_counted(node):
+            return None
+        if isinstance(node, FUNCTION_TYPES):
+            return self.function_complexity(node)
+        return self.class_real_complexity(node)
+
+    def blocks(self):
+        """(node, complexity) for every reported unit, in visiting order."""
+        return [(node, self.complexity(node)) for node in self.owners if self.is_counted(node)]
+
+    def module_units(self):
+        return [node for node, owner in self.owners.items() if owner is self.tree]
+
+    def blocks_total(self):
+        """
+        Sum over the blocks radon's cc_visit lists: module-level functions,
+        module-level classes and their methods.
+        """
+        total = 0
+        for node in self.module_units():
+            total += self.complexity(node)
+            if isinstance(node, ast.ClassDef):
+                total += sum(map(self.function_complexity, self.methods[node]))
+        return total
+
+    def total_complexity(self):
+        """Decision points of the whole module plus one, the input radon's MI uses."""
+        total = 1 + self.decisions[self.tree]
+        for node in self.module_units():
+            if isinstance(node, ast.ClassDef):
+                total += self.class_real_complexity(node) - 1
+            else:
+                total += self.function_complexity(node) - 1
+        return total
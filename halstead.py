@@ -0,0 +1,175 @@
+import ast
+import math
+from collections import Counter, deque
+
+FUNCTION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+# Operators and operand expressions of each counted node type.
+HALSTEAD_RULES = {
+    ast.BinOp: lambda node: ((node.op,), (node.left, node.right)),
+    ast.UnaryOp: lambda node: ((node.op,), (node.operand,)),
+    ast.BoolOp: lambda node: ((node.op,), node.values),
+    ast.AugAssign: lambda node: ((node.op,), (node.target, node.value)),
+    ast.Compare: lambda node: (node.ops, node.comparators + [node.left]),
+}
+OPERAND_FIELDS = {ast.Name: 'id', ast.Attribute: 'attr', ast.Constant: 'value'}
+
+class HalsteadCounts:
+    """
+    Operator and operand occurrences of a piece of code. Operators are keyed
+    by kind (e.g. 'Add', 'Eq'); operands by the function they appear in and
+    their name, attribute or constant value. Any other operand expression
+    (a call, a subscript, ...) is never equal to another one and is only
+    counted in `unique_operands`. Counts add up without recounting, so
+    function, class, file and package figures are all merges.
+    """
+    def __init__(self, operators=None, operands=None, unique_operands=0):
+        self.operators = Counter(operators or {})
+        self.operands = Counter(operands or {})
+        self.unique_operands = unique_operands
+
+    def add(self, context, operators, operands):
+        self.operators.update(type(op).__name__ for op in operators)
+        for operand in operands:
+            field = OPERAND_FIELDS.get(type(operand))
+            if field is None:
+                self.unique_operands += 1
+            else:
+                self.operands[(context, getattr(operand, field))] += 1
+
+    def update(self, other):
+        self.operators.update(other.operators)
+        self.operands.update(other.operands)
+        self.unique_operands += other.unique_operands
+
+    def subtract(self, other):
+        self.operators.subtract(other.operators)
+        self.operands.subtract(other.operands)
+        self.unique_operands -= other.unique_operands
+        # Drop the operators and operands that no longer occur at all.
+        self.operators = +self.operators
+        self.operands = +self.operands
+
+    def __add__(self, other):
+        merged = HalsteadCounts(self.operators, self.operands, self.unique_operands)
+        merged.update(other)
+        return merged
+
+    @classmethod
+    def merge(cls, counts):
+        merged = cls()
+        for other in counts:
+            merged.update(other)
+        return merged
+
+    def to_json(self):
+        return {
+            'operators': dict(self.operators),
+            'operands': {f"{context or ''}:{type(value).__name__}:{value!r}": count
+                         for (context, value), count in self.operands.items()},
+            'unique_operands': self.unique_operands
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        # Operand keys stay in their serialized form, which is equally good
+        # for telling operands apart when merging.
+        return cls(data['operators'], data['operands'], data['unique_operands'])
+
+    def report(self):
+        h1 = len(self.operators)
+        h2 = len(self.operands) + self.unique_operands
+        N1 = sum(self.operators.values())
+        N2 = sum(self.operands.values()) + self.unique_operands
+        vocabulary = h1 + h2
+        length = N1 + N2
+        volume = length * math.log(vocabulary, 2) if vocabulary else 0
+        difficulty = (h1 * N2) / float(2 * h2) if h2 else 0
+        effort = difficulty * volume
+        return {
+            'unique_operators': h1,
+            'unique_operands': h2,
+            'total_operators': N1,
+            'total_operands': N2,
+            'vocabulary': vocabulary,
+            'length': length,
+            'volume': volume,
+            'difficulty': difficulty,
+            'effort': effort,
+            'time': effort / 18.0,
+            'bugs': volume / 3000.0
+        }
+
+class HalsteadCounter:
+    """
+    Halstead counts of a module and of each function in it, with radon's
+    counting rules: binary, unary and boolean operators, augmented
+    assignments and comparisons, outside function headers (decorators,
+    defaults, annotations). A function's counts cover its whole body,
+    nested functions included.
+
+    Like ComplexityCounter, it is fed node by node by a traversal through
+    count() and child_owners(), or walks the tree itself with from_tree().
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        self.counts = {tree: HalsteadCounts()}
+        self.parents = {}
+        self.finished = False
+
+    @classmethod
+    def from_tree(cls, tree):
+        counter = cls(tree)
+        todo = deque([(tree, tree)])
+        while todo:
+            node, owner = todo.popleft()
+            counter.count(node, owner)
+            todo.extend(counter.child_owners(node, owner))
+        return counter
+
+    def count(self, node, owner):
+        if owner is None:
+            return
+        if isinstance(node, FUNCTION_TYPES):
+            self.parents[node] = owner
+            self.counts[node] = HalsteadCounts()
+        rule = HALSTEAD_RULES.get(type(node))
+        if rule is not None:
+            operators, operands = rule(node)
+            self.counts[owner].add(owner.name if owner is not self.tree else None, operators, operands)
+
+    def update(self, other):
+        """
+        Take in a counter that walked one module-level function or class on
+        its own, with its own `tree` standing in for this module. The other
+        counter's functions are folded first and are not folded again here.
+        """
+        other.finish()
+        for node, counts in other.counts.items():
+            if node is other.tree:
+                self.counts[self.tree].update(counts)
+            else:
+                self.counts[node] = counts
+
+    def child_owners(self, node, owner):
+        children = ast.iter_child_nodes(node)
+        if owner is not None and isinstance(node, FUNCTION_TYPES):
+            return ((child, node if isinstance(child, ast.stmt) else None) for child in children)
+        return ((child, owner) for child in children)
+
+    def finish(self):
+        # Counts were taken for the innermost function only; fold each
+        # function into the one around it (or the module), innermost first.
+        if not self.finished:
+            for node in reversed(list(self.parents)):
+                self.counts[self.parents[node]].update(self.counts[node])
+            self.finished = True
+
+    def module_counts(self):
+        self.finish()
+        return self.counts[self.tree]
+
+    def function_counts(self, node):
+        """Counts of a function's body, or None for code outside any function."""
+        self.finish()
+        return self.counts.get(node)
@@ -0,0 +1,173 @@
+import fnmatch
+import os
+import subprocess
+
+from code_metrics_integrated import analyze_code
+
+STATUS_NAMES = {'A': 'added', 'D': 'deleted'}
+
+def run_git(args, cwd):
+    result = subprocess.run(['git'] + args, cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result.stdout
+
+def target_root(target):
+    """
+    The directory a target's files are collected under, spelled as in the
+    target: the target directory, a file's directory, or the leading
+    directories of a glob pattern before its first wildcard.
+    """
+    if os.path.isdir(target):
+        return target
+    parts = []
+    for part in target.split(os.sep)[:-1]:
+        if any(char in part for char in '*?['):
+            break
+        parts.append(part)
+    return os.sep.join(parts)
+
+def git_dir(target):
+    return os.path.abspath(target_root(target) or '.')
+
+def in_target(path, target):
+    """Whether a path that no longer exists would have been collected for target."""
+    if os.path.isdir(target):
+        return os.path.abspath(path).startswith(os.path.abspath(target) + os.sep)
+    if os.path.isfile(target):
+        return os.path.abspath(path) == os.path.abspath(target)
+    name = os.path.relpath(path).split(os.sep)
+    pattern = os.path.normpath(os.path.relpath(target)).split(os.sep)
+    if '**' in pattern:
+        return fnmatch.fnmatch(os.sep.join(name), os.sep.join(pattern))
+    # Without '**', a wildcard matches within one directory level only.
+    return len(name) == len(pattern) and all(map(fnmatch.fnmatch, name, pattern))
+
+def collected_name(path, target):
+    """
+    An absolute path named the way collect_files(target) names files: under
+    the target directory, or under the fixed leading directories of a glob
+    pattern, spelled as in the target.
+    """
+    if os.path.abspath(path) == os.path.abspath(target):
+        return target
+    root = target_root(target)
+    if not root:
+        return os.path.relpath(path)
+    return os.path.join(root, os.path.relpath(path, os.path.abspath(root)))
+
+def changed_files(base, target, files):
+    """
+    Python files of the target that differ from the `base` revision
+    (committed, staged, unstaged or untracked), as ({path: 'added' |
+    'modified' | 'deleted'}, repository top level). Paths match those in
+    `files`; deleted files are named the same way.
+    """
+    cwd = git_dir(target)
+    toplevel = run_git(['rev-parse', '--show-toplevel'], cwd).strip()
+    fields = run_git(['diff', '--name-status', '-z', '--no-renames', base, '--'], cwd).split('\0')
+    changed = {os.path.join(toplevel, name): STATUS_NAMES.get(code[:1], 'modified')
+               for code, name in zip(fields[::2], fields[1::2]) if name.endswith('.py')}
+    for name in run_git(['ls-files', '--others', '--exclude-standard', '--full-name', '-z'], cwd).split('\0'):
+        if name.endswith('.py'):
+            changed[os.path.join(toplevel, name)] = 'added'
+
+    status = {}
+    for path in files:
+        change = changed.pop(os.path.abspath(path), None)
+        if change:
+            status[path] = change
+    for path, change in changed.items():
+        if change == 'deleted' and in_target(path, target):
+            status[collected_name(path, target)] = change
+    return status, toplevel
+
+def base_source(base, path, toplevel):
+    """The file's source at `base`, or None if it did not exist there."""
+    relpath = os.path.relpath(os.path.abspath(path), toplevel).replace(os.sep, '/')
+    result = subprocess.run(['git', 'show', f"{base}:{relpath}"], cwd=toplevel, capture_output=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode('utf-8')
+
+def analyze_base_versions(base, status, toplevel, cache, options):
+    """
+    Metrics of each changed file as it was at `base`, served from the cache
+    whenever that source has been analyzed before (e.g. by the run on the
+    base revision). Returns (results, errors).
+    """
+    results, errors = {}, {}
+    for path, change in status.items():
+        if change == 'added':
+            continue
+        code = base_source(base, path, toplevel)
+        if code is None:
+            errors[path] = f"not readable at {base}"
+            continue
+        key = cache.key(code) if cache else None
+        metrics = cache.get(key) if cache else None
+        if metrics is None:
+            try:
+                metrics = analyze_code(path, code=code, **options)
+            except Exception as e:
+                errors[path] = f"{type(e).__name__}: {e}"
+                continue
+            if cache:
+                cache.put(key, metrics)
+        metrics.pop('project_summary', None)
+        results[path] = metrics
+    return results, errors
+
+def numeric_leaves(metrics, prefix=''):
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(numeric_leaves(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + name] = value
+    return flat
+
+def compare_metrics(before, after):
+    """{metric: {'before', 'after', 'change'}} for every numeric value that differs."""
+    before, after = numeric_leaves(before or {}), numeric_leaves(after or {})
+    changes = {}
+    for name in sorted(before.keys() | after.keys()):
+        old, new = before.get(name), after.get(name)
+        if old != new:
+            changes[name] = {
+                'before': old,
+                'after': new,
+                'change': new - old if old is not None and new is not None else None
+            }
+    return changes
+
+def units_by_name(metrics):
+    # Line spans move between revisions, so units are matched by qualified
+    # name; the first of duplicate names is used.
+    units = {}
+    for unit in (metrics or {}).get('granular_metrics', {}).values():
+        units.setdefault(unit['qualified_name'], unit)
+    return units
+
+def unit_deltas(before, after):
+    before, after = units_by_name(before), units_by_name(after)
+    deltas = {}
+    for name in sorted(before.keys() | after.keys()):
+        if name not in before:
+            deltas[name] = {'status': 'added', 'metrics': compare_metrics(None, after[name])}
+        elif name not in after:
+            deltas[name] = {'status': 'removed', 'metrics': compare_metrics(before[name], None)}
+        else:
+            changes = compare_metrics(before[name], after[name])
+            if changes:
+                deltas[name] = {'status': 'modified', 'metrics': changes}
+    return deltas
+
+def file_delta(change, before, after, error=None):
+    delta = {'status': change}
+    if error:
+        delta['error'] = error
+    for block in ('static_metrics', 'intermediate_level_metrics'):
+        delta[block] = compare_metrics((before or {}).get(block), (after or {}).get(block))
+    delta['functions'] = unit_deltas(before, after)
+    return delta
@@ -0,0 +1,105 @@
+import bisect
+import itertools
+import tokenize
+
+LINE_KINDS = ('logical', 'source', 'comment', 'docstring', 'blank')
+SKIPPED_TOKENS = (tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE)
+
+def only_token(token_type, tokens):
+    """Whether the logical line is a single `token_type` token and line breaks."""
+    return tokens[0].type == token_type and all(t.type in (tokenize.NL, tokenize.NEWLINE) for t in tokens[1:])
+
+def logical_count(tokens):
+    """
+    Logical lines in one tokenized logical line, counted as radon does:
+    statements separated by `;` count once each, and a compound statement
+    with its body on the same line (`if x: return`) counts twice.
+    """
+    statements = [[]]
+    for token in tokens:
+        if token.type == tokenize.OP and token.string == ';':
+            statements.append([])
+        elif token.type not in SKIPPED_TOKENS:
+            statements[-1].append(token)
+    # radon tokenizes each logical line on its own, so only the last
+    # statement is followed by an end marker; where a colon "ends" a
+    # statement is judged with that in mind.
+    statements[-1].append(None)
+    count = 0
+    for statement in statements:
+        colons = [i for i, t in enumerate(statement)
+                  if t is not None and t.type == tokenize.OP and t.string == ':']
+        if colons:
+            count += 2 - (colons[-1] == len(statement) - 2)
+        elif any(t is not None for t in statement):
+            count += 1
+    return count
+
+class LineClassifier:
+    """
+    Classifies every physical line of a token stream in one pass:
+
+    - source: non-blank lines of statements;
+    - comment: lines holding a comment, alone or after code;
+    - docstring: non-blank lines of string-only statements;
+    - blank: empty lines, including those inside a docstring;
+    - logical: logical lines (see logical_count()).
+
+    These are radon's sloc, comments, multi (plus single-line docstrings),
+    blank and lloc, so the maintainability index can use them directly.
+    Counts are kept per row as prefix sums, which makes counting any line
+    span (a function, a class) constant time.
+    """
+    def __init__(self, logical_lines, rows):
+        row_counts = {kind: [0] * (rows + 1) for kind in LINE_KINDS}
+        for tokens, parsed_lines in logical_lines:
+            start_row = tokens[0].start[0]
+            row_counts['logical'][start_row] += logical_count(tokens)
+            for token in tokens:
+                if token.type == tokenize.COMMENT:
+                    row_counts['comment'][token.start[0]] += 1
+            if only_token(tokenize.COMMENT, tokens):
+                continue
+            kind = 'docstring' if only_token(tokenize.STRING, tokens) else 'source'
+            for row, parsed_line in enumerate(parsed_lines, start_row):
+                row_counts[kind if parsed_line else 'blank'][row] += 1
+        self.rows = rows
+        self.before = {kind: list(itertools.accumulate(counts)) for kind, counts in row_counts.items()}
+
+    def counts(self, first=1, last=None):
+        """Line counts of rows first..last (inclusive; the whole file by default)."""
+        last = self.rows if last is None else last
+        counts = {'physical': last - first + 1}
+        for kind, before in self.before.items():
+            counts[kind] = before[last] - before[first - 1]
+        return counts
+
+class SegmentedClassifier:
+    """
+    Line counts of a file classified in consecutive segments of whole
+    statements (the top-level functions and classes and the code between
+    them), each by a LineClassifier of its own, so a segment that has not
+    changed keeps its classification. `segments` are (first row,
+    LineClassifier) pairs in file order; counts() works as on a
+    LineClassifier of the whole file.
+    """
+    def __init__(self, segments, rows):
+        self.firsts = [first for first, _ in segments]
+        self.classifiers = [classifier for _, classifier in segments]
+        self.rows = rows
+
+    def counts(self, first=1, last=None):
+        """Line counts of rows first..last (inclusive; the whole file by default)."""
+        last = self.rows if last is None else last
+        counts = dict.fromkeys(('physical',) + LINE_KINDS, 0)
+        counts['physical'] = last - first + 1
+        segment = max(bisect.bisect_right(self.firsts, first) - 1, 0)
+        while segment < len(self.firsts) and self.firsts[segment] <= last:
+            offset = self.firsts[segment] - 1
+            classifier = self.classifiers[segment]
+            start, end = max(first - offset, 1), min(last - offset, classifier.rows)
+            if start <= end:
+                for kind, before in classifier.before.items():
+                    counts[kind] += before[end] - before[start - 1]
+            segment += 1
+        return counts
@@ -0,0 +1,21 @@
+import math
+
+# 'sei': the SEI formula with its comment term, rescaled to 0-100 as radon
+# reports it. 'vs': Visual Studio's variant, which drops the comment term.
+MI_VARIANTS = ('sei', 'vs')
+DEFAULT_MI_VARIANT = 'sei'
+
+def maintainability_index(volume, complexity, lloc, comments=0, variant=DEFAULT_MI_VARIANT):
+    """
+    Maintainability Index (0-100) from its components: Halstead volume,
+    cyclomatic complexity, logical lines of code and the percentage of
+    comment lines. Code without volume or lines scores 100, as in radon.
+    """
+    if variant not in MI_VARIANTS:
+        raise ValueError(f"unknown MI variant {variant!r} (expected one of {', '.join(MI_VARIANTS)})")
+    if volume <= 0 or lloc <= 0:
+        return 100.0
+    mi = 171 - 5.2 * math.log(volume) - 0.23 * complexity - 16.2 * math.log(lloc)
+    if variant == 'sei':
+        mi += 50 * math.sin(math.sqrt(2.46 * math.radians(comments)))
+    return min(max(0.0, mi * 100 / 171.0), 100.0)
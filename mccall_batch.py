@@ -0,0 +1,100 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from code_metrics_integrated import MAX_VALUES, MCCALL_INPUTS
+
+# Column of each McCall input in the corpus matrix.
+COLUMNS = {name: i for i, name in enumerate(MCCALL_INPUTS)}
+
+# Each attribute as (metric, weight, inverted) terms, where a term is
+# weight * metric / max, or weight * (1 - metric / max) when inverted.
+# Terms are in the order calculate_mccall_metrics adds them.
+MCCALL_WEIGHTS = {
+    "Modifiability": [('cyclomatic_complexity', 0.4, True), ('comment_density', 0.3, False),
+                      ('maintainability_index', 0.3, False)],
+    "Testability": [('cyclomatic_complexity', 0.5, True), ('maintainability_index', 0.5, False)],
+    "Reliability": [('cyclomatic_complexity', 0.4, True), ('cbo', 0.3, True), ('lcom', 0.3, False)],
+    "Understandability": [('comment_density', 0.35, False), ('fan_in', 0.25, True), ('fan_out', 0.25, True),
+                          ('loc', 0.15, True)],
+    "Self-Descriptiveness": [('comment_density', 0.5, False), ('loc', 0.5, False)],
+    "Reusability": [('cbo', 0.5, True), ('dit', 0.5, True)],
+    "Portability": [('loc', 0.7, True), ('cyclomatic_complexity', 0.3, True)],
+    "Efficiency": [('cyclomatic_complexity', 0.4, True), ('effort', 0.4, True), ('loc', 0.2, True)],
+}
+# Attributes calculate_mccall_metrics caps at 1 and floors at 0.
+CLAMPED_ATTRIBUTES = ("Efficiency",)
+
+def metric_row(metrics):
+    """
+    Input values of one file, from an analyze_code result or from a flat
+    metrics dict as calculate_mccall_metrics and metrics2.py take it.
+    Missing metrics count as 0.
+    """
+    if 'static_metrics' in metrics:
+        static = metrics['static_metrics']
+        return [static.get(label, 0) for label in MCCALL_INPUTS.values()]
+    effort = metrics.get('halstead_metrics', {}).get('effort', metrics.get('effort', 0))
+    return [effort if name == 'effort' else metrics.get(name, 0) for name in MCCALL_INPUTS]
+
+def metric_matrix(corpus):
+    """(N, len(MCCALL_INPUTS)) float matrix of the metrics of N files."""
+    return np.array([metric_row(metrics) for metrics in corpus], dtype=float).reshape(-1, len(MCCALL_INPUTS))
+
+def score_matrix(matrix, max_values=MAX_VALUES, clamp=False):
+    """
+    McCall attributes of every row of a metric matrix, as {attribute: array}.
+    Each normalized column (and its complement) is computed once and the
+    weighted terms are summed column-wise in the scalar formulas' order, so
+    every score is bit-for-bit what calculate_mccall_metrics returns for
+    that file. With
+    `clamp`, all attributes are limited to [0, 1], not only Efficiency.
+    """
+    limits = np.array([max_values[name] for name in MCCALL_INPUTS], dtype=float)
+    # One contiguous row per metric, and its complement, shared by every
+    # attribute that uses it.
+    normalized = np.ascontiguousarray((matrix / limits).T)
+    complement = 1 - normalized
+    scores = {}
+    for attribute, terms in MCCALL_WEIGHTS.items():
+        score = None
+        for name, weight, inverted in terms:
+            term = weight * (complement if inverted else normalized)[COLUMNS[name]]
+            score = term if score is None else score + term
+        if clamp or attribute in CLAMPED_ATTRIBUTES:
+            score = np.clip(score, 0, 1)
+        scores[attribute] = score
+    return scores
+
+def score_corpus(corpus, max_values=MAX_VALUES, clamp=False):
+    """McCall attributes of each file in `corpus` ({path: metrics}), keyed by path."""
+    paths = list(corpus)
+    scores = score_matrix(metric_matrix(corpus.values()), max_values, clamp)
+    return {path: {attribute: float(values[i]) for attribute, values in scores.items()}
+            for i, path in enumerate(paths)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every file of a project report with McCall's model.")
+    parser.add_argument('report', help="project report written by code_metrics_integrated.py in project mode")
+    parser.add_argument('--output', default='mccall_scores.json', help="where to write the per-file scores")
+    parser.add_argument('--clamp', action='store_true', help="limit every attribute to [0, 1]")
+    parser.add_argument('--thresholds', default=None, help="thresholds profile to normalize with")
+    args = parser.parse_args()
+    max_values = MAX_VALUES
+    if args.thresholds:
+        from thresholds import load_thresholds
+        max_values = load_thresholds(args.thresholds)
+
+    with open(args.report, 'r', encoding='utf-8') as f:
+        files = json.load(f)['files']
+    start = time.perf_counter()
+    scores = score_corpus(files, max_values, args.clamp)
+    elapsed = time.perf_counter() - start
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(scores, f, indent=4)
+    print(f"Scored {len(scores)} files in {elapsed * 1000:.2f} ms; scores saved to '{args.output}'.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from code_metrics_integrated import ANALYZER_VERSION, MAX_VALUES
+from maintainability import DEFAULT_MI_VARIANT
+
+DEFAULT_CACHE_DIR = '.insightify_cache'
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_ANALYSIS_TTL = 7 * 24 * 3600
+DEFAULT_MAX_UNITS = 20000
+
+def source_digest(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+def config_digest(max_values=MAX_VALUES):
+    return hashlib.sha256(json.dumps(max_values, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def analysis_config(max_values=MAX_VALUES, granular=False, project_summary=False, halstead_counts=False,
+                    mi_variant=DEFAULT_MI_VARIANT):
+    """Everything besides the source that determines an analyze_code result."""
+    sections = '+'.join(name for name, enabled in (
+        ('granular', granular), ('project', project_summary), ('halstead', halstead_counts)) if enabled)
+    return f"{ANALYZER_VERSION}:{config_digest(max_values)}:{mi_variant}:{sections or 'file'}"
+
+class SQLiteCache:
+    """
+    JSON values in a single SQLite table under the cache directory. Reads
+    refresh an entry's last_used time; on close, expired entries (when a ttl
+    is set) are dropped and the least recently used ones are evicted once the
+    cache grows past max_entries or max_bytes.
+
+    Each read or write is committed at once, or with the others of a batch
+    in transaction(), so a long-running process (a watcher, a daemon) never
+    holds the database locked against other runs sharing the cache, and
+    loses nothing it cached if it is killed.
+    """
+    def __init__(self, cache_dir, filename, max_entries, max_bytes, ttl=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(os.path.join(cache_dir, filename), timeout=30, isolation_level=None)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def get(self, key):
+        row = self.conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        payload = json.dumps(value)
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload), now, now)
+        )
+
+    @contextmanager
+    def transaction(self):
+        """Commit the reads and writes made inside the block together."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def evict(self):
+        if self.ttl is not None:
+            self.conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM entries WHERE key NOT IN"
+            " (SELECT key FROM entries ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Walk from the most recently used entry and drop everything past the
+        # point where the byte budget is exhausted.
+        kept = 0
+        stale = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_used DESC"):
+            kept += size
+            if kept > self.max_bytes:
+                stale.append((key,))
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def close(self):
+        with self.transaction():
+            self.evict()
+        self.conn.close()
+
+class MetricsCache(SQLiteCache):
+    """
+    On-disk cache of analyze_code results (static metrics and McCall blocks),
+    keyed by the SHA-256 of the source, the analyzer version, the threshold
+    config, the MI variant and which optional sections (granular per-unit
+    metrics, project summary, Halstead counts) were requested.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, max_values=MAX_VALUES, granular=False,
+                 project_summary=False, halstead_counts=False, mi_variant=DEFAULT_MI_VARIANT):
+        super().__init__(cache_dir, 'metrics.sqlite', max_entries, max_bytes)
+        self.config = analysis_config(max_values, granular, project_summary, halstead_counts, mi_variant)
+
+    def key(self, code):
+        return f"{source_digest(code)}:{self.config}"
+
+class UnitCache:
+    """
+    In-memory LRU of what CodeMetricsAnalyzer gathered from module-level
+    functions and classes and the methods of those classes (their
+    collectors) and from stretches of lines (their line classifications),
+    keyed by a digest of the source lines. Holding AST nodes, it lives only
+    as long as the process: a watcher re-analyzing a file after an edit only
+    walks and tokenizes the units that changed.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_UNITS):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class AnalysisCache(SQLiteCache):
+    """
+    GPT analysis responses keyed by a hash of everything that goes into the
+    prompt: the code, the metrics, the model name and the prompt template
+    version. Entries expire after ttl seconds.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_ANALYSIS_TTL):
+        super().__init__(cache_dir, 'gpt_analysis.sqlite', max_entries, max_bytes, ttl)
+
+    def key(self, code, metrics, model, prompt_version):
+        fingerprint = json.dumps([prompt_version, model, code, metrics], sort_keys=True)
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
@@ -0,0 +1,266 @@
+import argparse
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from code_metrics_integrated import MAX_VALUES
+from maintainability import DEFAULT_MI_VARIANT, MI_VARIANTS
+from metrics_cache import DEFAULT_MAX_UNITS, UnitCache, analysis_config, source_digest
+from project_metrics import analyze_file, available_cores
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_REPORTS = 10000
+DEFAULT_MAX_PENDING = 256
+# Name given to sources posted without a path.
+ANONYMOUS_PATH = '<request>'
+
+class ServiceBusy(Exception):
+    pass
+
+class ServiceError(Exception):
+    pass
+
+# Each worker process keeps a unit cache of its own, so a source posted
+# again after an edit has only its changed functions and classes walked
+# again, if it lands on a worker that saw it before.
+worker_unit_cache = None
+
+def init_worker(max_units):
+    global worker_unit_cache
+    worker_unit_cache = UnitCache(max_units)
+
+def analyze_in_worker(path, timeout, options):
+    return analyze_file(path, timeout, dict(options, unit_cache=worker_unit_cache))
+
+class MetricsService:
+    """
+    Warm state of the metrics daemon. Finished reports are kept in an LRU
+    keyed by source digest and analysis config, so a report's id is stable
+    and a source seen before is answered without touching a worker. Each
+    distinct source in flight is analyzed once, however many requests ask
+    for it, on a process pool of `workers` processes with at most
+    `max_pending` analyses queued. Each worker keeps the functions and
+    classes it has collected in a unit cache of up to `max_units` entries;
+    sources are still parsed in full. The thresholds profile (`max_values`)
+    is loaded once for the daemon's lifetime.
+    """
+    def __init__(self, workers, timeout=60, max_values=MAX_VALUES, max_reports=DEFAULT_MAX_REPORTS,
+                 max_pending=DEFAULT_MAX_PENDING, max_units=DEFAULT_MAX_UNITS):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_values = max_values
+        self.max_reports = max_reports
+        self.max_pending = max_pending
+        self.max_units = max_units
+        self.executor = self.new_pool()
+        self.reports = OrderedDict()
+        self.pending = {}
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def new_pool(self):
+        return ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.max_units,))
+
+    def replace_pool(self, executor):
+        # Replace a broken pool once, however many of its analyses fail.
+        with self.lock:
+            if self.executor is executor:
+                self.executor = self.new_pool()
+
+    def report_id(self, code, options):
+        config = analysis_config(self.max_values, options.get('granular', False),
+                                 options.get('project_summary', False), False,
+                                 options.get('mi_variant', DEFAULT_MI_VARIANT))
+        return hashlib.sha256(f"{source_digest(code)}:{config}".encode('utf-8')).hexdigest()
+
+    def submit(self, path, code, options):
+        """
+        Start analyzing `code` unless a report of it is at hand. Returns
+        (report id, finished report or None while it is being analyzed).
+        """
+        report_id = self.report_id(code, options)
+        with self.lock:
+            report = self.reports.get(report_id)
+            if report is not None and report['status'] == 'done':
+                self.reports.move_to_end(report_id)
+                self.hits += 1
+                return report_id, report
+            if report_id not in self.pending:
+                if len(self.pending) >= self.max_pending:
+                    raise ServiceBusy(f"{len(self.pending)} analyses already queued")
+                executor, future = self.start(path, code, options)
+                self.misses += 1
+                self.pending[report_id] = threading.Event()
+                future.add_done_callback(lambda future: self.finish(report_id, path, executor, future))
+        return report_id, None
+
+    def start(self, path, code, options):
+        # A pool broken since its last analysis finished fails right here;
+        # it is replaced and the analysis tried once more.
+        options = dict(options, code=code, max_values=self.max_values)
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return executor, executor.submit(analyze_in_worker, path, self.timeout, options)
+            except BrokenProcessPool:
+                self.replace_pool(executor)
+        raise ServiceError("worker pool could not be restarted")
+
+    def finish(self, report_id, path, executor, future):
+        try:
+            _, metrics, error = future.result()
+        except BrokenProcessPool:
+            metrics, error = None, "worker process died"
+            self.replace_pool(executor)
+        except Exception as e:
+            metrics, error = None, f"{type(e).__name__}: {e}"
+        report = {'id': report_id, 'path': path, 'status': 'failed' if error else 'done'}
+        if error:
+            report['error'] = error
+        else:
+            report['metrics'] = metrics
+        with self.lock:
+            self.reports[report_id] = report
+            self.reports.move_to_end(report_id)
+            while len(self.reports) > self.max_reports:
+                self.reports.popitem(last=False)
+            self.pending.pop(report_id).set()
+
+    def wait(self, report_id, timeout=None):
+        """The report once it is finished, or None if that takes over `timeout` seconds."""
+        with self.lock:
+            done = self.pending.get(report_id)
+        if done is not None and not done.wait(timeout):
+            return None
+        return self.report(report_id)
+
+    def report(self, report_id):
+        with self.lock:
+            if report_id in self.pending:
+                return {'id': report_id, 'status': 'pending'}
+            return self.reports.get(report_id)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'reports': len(self.reports),
+                'pending': len(self.pending),
+                'cache_hits': self.hits,
+                'cache_misses': self.misses
+            }
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /analyze with a JSON body {"code": ...} or {"path": ...} (both to
+    name posted code), plus optional "granular", "project_summary",
+    "mi_variant" and "wait" (default true: answer with the finished report
+    rather than 202 and its id). GET /report/{id} returns a report, GET
+    /stats the daemon's counters.
+    """
+    service = None
+
+    def do_POST(self):
+        if self.path != '/analyze':
+            return self.send_json(404, {'error': f"no such endpoint: {self.path}"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError as e:
+            return self.send_json(400, {'error': f"invalid JSON: {e}"})
+        if not isinstance(request, dict):
+            return self.send_json(400, {'error': "expected a JSON object"})
+        for name in ('path', 'code'):
+            if request.get(name) is not None and not isinstance(request[name], str):
+                return self.send_json(400, {'error': f"'{name}' must be a string"})
+        for name in ('granular', 'project_summary', 'wait'):
+            if name in request and not isinstance(request[name], bool):
+                return self.send_json(400, {'error': f"'{name}' must be true or false"})
+        path, code = request.get('path'), request.get('code')
+        if code is None:
+            if not path:
+                return self.send_json(400, {'error': "either 'code' or 'path' is required"})
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    code = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                return self.send_json(400, {'error': f"cannot read {path}: {e}"})
+        options = {
+            'granular': request.get('granular', False),
+            'project_summary': request.get('project_summary', False),
+            'mi_variant': request.get('mi_variant', DEFAULT_MI_VARIANT)
+        }
+        if options['mi_variant'] not in MI_VARIANTS:
+            return self.send_json(400, {'error': f"unknown mi_variant {options['mi_variant']!r}"})
+        try:
+            report_id, report = self.service.submit(path or ANONYMOUS_PATH, code, options)
+        except ServiceBusy as e:
+            return self.send_json(503, {'error': f"server busy: {e}"})
+        except ServiceError as e:
+            return self.send_json(500, {'error': str(e)})
+        if report is None and request.get('wait', True):
+            report = self.service.wait(report_id, self.service.timeout)
+        if report is None or report['status'] == 'pending':
+            return self.send_json(202, {'id': report_id, 'status': 'pending'})
+        self.send_json(200, report)
+
+    def do_GET(self):
+        if self.path.startswith('/report/'):
+            report = self.service.report(self.path[len('/report/'):])
+            if report is None:
+                return self.send_json(404, {'error': "unknown report id"})
+            return self.send_json(200, report)
+        if self.path == '/stats':
+            return self.send_json(200, self.service.stats())
+        self.send_json(404, {'error': f"no such endpoint: {self.path}"})
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve code metrics over a local HTTP/JSON API.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="analysis worker processes (default: available cores)")
+    parser.add_argument('--timeout', type=float, default=60, help="per-file analysis timeout in seconds")
+    parser.add_argument('--thresholds', default=None,
+                        help="thresholds profile (from --calibrate) to normalize the McCall attributes with")
+    parser.add_argument('--max-reports', type=int, default=DEFAULT_MAX_REPORTS,
+                        help="finished reports kept in memory")
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help="analyses queued before requests are turned away with 503")
+    args = parser.parse_args()
+
+    max_values = MAX_VALUES
+    if args.thresholds:
+        from thresholds import load_thresholds
+        max_values = load_thresholds(args.thresholds)
+    service = MetricsService(args.workers or available_cores(), args.timeout, max_values,
+                             args.max_reports, args.max_pending)
+    MetricsRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), MetricsRequestHandler)
+    print(f"Serving metrics on http://{args.host}:{server.server_port} with {service.workers} workers.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,18 @@
+import argparse
 import json
 import os
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, Spacer, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 import sys
 from openai import OpenAI
 
+from code_metrics_integrated import analyze_code
+from metrics_cache import DEFAULT_CACHE_DIR, AnalysisCache
+from prompt_builder import DEFAULT_PROMPT_BUDGET, PROMPT_VERSION, build_prompt
+
 import re
 from reportlab.platypus import PageBreak
 
@@ -21,29 +26,32 @@ client = OpenAI(
 )
 
 
-def send_to_gpt_for_analysis(code, metrics):
-    # Prepare the prompt to send to the GPT model
-    prompt = (
-        "You are an expert software engineer and code quality analyst. "
-        "Below is a Python program and its corresponding metrics. "
-        "I need an analysis report on how to improve this code, identifying specific areas and suggesting improvements.\n\n"
-        "Python Code:\n"
-        f"{code}\n\n"
-        "Code Metrics:\n"
-        f"{json.dumps(metrics, indent=4)}\n\n"
-        "Please provide detailed feedback on what can be improved in this code, including refactoring suggestions, best practices, and explanations of where and why changes should be made."
-        "Don't give these type of starting lines, Certainly! Here's a detailed analysis of the provided Python code along with suggestions for improvements that can be made to enhance code quality, maintainability, and readability."
-    )
+GPT_MODEL = "gpt-4o-mini"  # Use the appropriate model available to you
+
+
+def send_to_gpt_for_analysis(code, metrics, granular, cache=None, budget=DEFAULT_PROMPT_BUDGET):
+    # Reuse a previous answer for the same code, metrics, model and prompt
+    key = cache.key(code, metrics, GPT_MODEL, f"{PROMPT_VERSION}:{budget}") if cache else None
+    if cache:
+        analysis = cache.get(key)
+        if analysis is not None:
+            print("GPT analysis served from cache.")
+            return analysis
+
+    # Prepare the prompt to send to the GPT model, within the token budget
+    prompt = build_prompt(code, metrics, granular, budget)
 
     # Call the OpenAI API
     response = client.chat.completions.create(
-        model="gpt-4o-mini",  # Use the appropriate model available to you
+        model=GPT_MODEL,
         messages=[{"role": "user", "content": prompt}],
     )
 
     # Extract and print the response
     analysis = response.choices[0].message.content
 
+    if cache:
+        cache.put(key, analysis)
     return analysis
 
 def format_analysis_text_for_pdf(analysis):
@@ -56,6 +64,21 @@ def format_analysis_text_for_pdf(analysis):
     
     return formatted_text
 
+# Source listings are emitted as one Preformatted flowable per page-sized
+# chunk rather than one Paragraph per line. Preformatted takes plain text, so
+# no markup escaping is needed, and long lines are wrapped to the frame width
+# of a Courier 10pt letter page.
+CODE_CHUNK_LINES = 50
+CODE_MAX_LINE_LENGTH = 78
+
+def code_block_flowables(text, style):
+    lines = text.splitlines()
+    return [
+        Preformatted('\n'.join(lines[start:start + CODE_CHUNK_LINES]), style,
+                     maxLineLength=CODE_MAX_LINE_LENGTH, newLineChars='')
+        for start in range(0, len(lines), CODE_CHUNK_LINES)
+    ]
+
 def generate_pdf_report(code, metrics, analysis, output_file):
     # Preprocess the analysis text for bold and code block formatting
     formatted_analysis = format_analysis_text_for_pdf(analysis)
@@ -79,9 +102,7 @@ def generate_pdf_report(code, metrics, analysis, output_file):
 
     # Add original code
     elements.append(Paragraph("Analyzed Code:", heading_style))
-    code_lines = code.splitlines()
-    for line in code_lines:
-        elements.append(Paragraph(f"<pre>{line}</pre>", code_style))
+    elements.extend(code_block_flowables(code, code_style))
     elements.append(Spacer(1, 12))
 
     # Add static metrics
@@ -137,9 +158,7 @@ def generate_pdf_report(code, metrics, analysis, output_file):
 
     for line in analysis_lines:
         if code_block_toggle:
-            code_lines_in_block = line.strip().splitlines()
-            for code_line in code_lines_in_block:
-                elements.append(Paragraph(code_line, code_style))
+            elements.extend(code_block_flowables(line.strip(), code_style))
             elements.append(Spacer(1, 6))
         else:
             # Process regular text with normal styles
@@ -166,77 +185,83 @@ def generate_pdf_report(code, metrics, analysis, output_file):
     print(f"PDF report saved to {output_file}")
 
 
-def main():
-    # Load code and metrics
-    if len(sys.argv) != 2:
-        print("Usage: python3 pdfreport.py <code_file>")
-        sys.exit(1)
-
-    code_file = sys.argv[1]
-    metrics_file = f'{code_file[:-3]}_metrics.json'  # Replace with your metrics JSON file path
-
-
-    with open(code_file, 'r', encoding='utf-8') as f:
-        code = f.read()
+def report_name(code_file):
+    # The source's path under the working directory, so same-named files of
+    # a batch do not overwrite each other's outputs; just its name for a
+    # source elsewhere, as joining an absolute or '..' path would put the
+    # outputs next to the source.
+    name = os.path.relpath(code_file)
+    if name.split(os.sep)[0] == os.pardir:
+        name = os.path.basename(code_file)
+    return os.path.splitext(name)[0]
 
-    # Run the code_metrics_integrated.py program to generate metrics
-    result = os.system(f"python3 code_metrics_integrated.py {code_file}")
-    if result != 0:
-        print("Error running code_metrics_integrated.py")
-        sys.exit(1)
 
-    # Check if the metrics file exists before trying to open it
-    if not os.path.exists(metrics_file):
-        print(f"Metrics file {metrics_file} does not exist.")
-        sys.exit(1)
+def save_metrics_json(code_file, metrics):
+    metrics_file = os.path.join('Metrics_jsons', f"{report_name(code_file)}_metrics.json")
+    os.makedirs(os.path.dirname(metrics_file), exist_ok=True)
+    with open(metrics_file, 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, indent=4)
+    print(f"Metrics saved to {metrics_file}")
 
-    # Load the generated metrics JSON file
-    with open(metrics_file, 'r', encoding='utf-8') as f:
-        metrics = json.load(f)
-    
-    analysis = send_to_gpt_for_analysis(code, metrics)
-
-    # Print analysis and optionally save to a file
-    print("GPT Analysis Report:")
-    print(analysis)
 
+def save_report_outputs(code_file, code, metrics, analysis):
     # Save analysis to a text file
-    
-    with open(f"{code_file[:3]}_gpt_analysis_report.txt", "w", encoding="utf-8") as f:
+    analysis_report_path = os.path.join('GPT_analysis', f"{report_name(code_file)}_gpt_analysis_report.txt")
+    os.makedirs(os.path.dirname(analysis_report_path), exist_ok=True)
+    with open(analysis_report_path, "w", encoding="utf-8") as f:
         f.write(analysis)
-    print("Analysis report saved to gpt_analysis_report.txt")
-
+    print(f"Analysis report saved to {analysis_report_path}")
 
     # Generate PDF report
-    output_file = f'{code_file[:-3]}_code_analysis_report.pdf'
+    output_file = os.path.join('PDF_reports', f"{report_name(code_file)}_code_analysis_report.pdf")
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
     generate_pdf_report(code, metrics, analysis, output_file)
 
 
-    
-            # Ensure the GPT_analysis directory exists
-    os.makedirs('Metrics_jsons', exist_ok=True)
+def main():
+    parser = argparse.ArgumentParser(description="Generate a code quality PDF report for a Python file.")
+    parser.add_argument('code_file', help="Python file to analyze")
+    parser.add_argument('--no-json', action='store_true',
+                        help="don't write the metrics JSON to Metrics_jsons/")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="directory holding the GPT analysis cache")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always request a fresh GPT analysis")
+    parser.add_argument('--prompt-budget', type=int, default=DEFAULT_PROMPT_BUDGET,
+                        help="maximum prompt size in tokens")
+    args = parser.parse_args()
+
+    code_file = args.code_file
 
-    # Move the analysis report to the GPT_analysis directory
-    analysis_report_path = f"Metrics_jsons/{code_file[:-3]}_metrics.json"
-    os.rename(f"{code_file[:-3]}_metrics.json", analysis_report_path)
-    print(f"Analysis report moved to {analysis_report_path}")
+    with open(code_file, 'r', encoding='utf-8') as f:
+        code = f.read()
 
-        # Ensure the GPT_analysis directory exists
-    os.makedirs('GPT_analysis', exist_ok=True)
+    # Compute the metrics in-process and hand the dict straight to the GPT and
+    # PDF stages; the JSON file is only a side output.
+    try:
+        metrics = analyze_code(code_file, code=code, granular=True)
+    except SyntaxError as e:
+        print(f"Error analyzing {code_file}: {e}")
+        sys.exit(1)
+    # Per-function metrics only rank the functions for the prompt.
+    granular = metrics.pop('granular_metrics')
 
-    # Move the analysis report to the GPT_analysis directory
-    analysis_report_path = f"GPT_analysis/{code_file[:3]}_gpt_analysis_report.txt"
-    os.rename(f"{code_file[:3]}_gpt_analysis_report.txt", analysis_report_path)
-    print(f"Analysis report moved to {analysis_report_path}")
+    if not args.no_json:
+        save_metrics_json(code_file, metrics)
 
-        # Ensure the GPT_analysis directory exists
-    os.makedirs('PDF_reports', exist_ok=True)
+    cache = None if args.no_cache else AnalysisCache(args.cache_dir)
+    try:
+        analysis = send_to_gpt_for_analysis(code, metrics, granular, cache, args.prompt_budget)
+    finally:
+        if cache:
+            cache.close()
+
+    # Print analysis
+    print("GPT Analysis Report:")
+    print(analysis)
+
+    save_report_outputs(code_file, code, metrics, analysis)
 
-    # Move the analysis report to the GPT_analysis directory
-    analysis_report_path = f"PDF_reports/{code_file[:-3]}_code_analysis_report.pdf"
-    os.rename(f"{code_file[:-3]}_code_analysis_report.pdf", analysis_report_path)
-    print(f"Analysis report moved to {analysis_report_path}")
 
-    
 if __name__ == "__main__":
     main()
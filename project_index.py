@@ -0,0 +1,117 @@
+import os
+
+# Bound on chains of re-exports (`from .impl import f` in a package
+# __init__) followed while resolving a name, which also stops import cycles.
+MAX_RESOLVE_DEPTH = 8
+
+def module_name(path, root):
+    parts = os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0].split(os.sep)
+    if parts[-1] == '__init__':
+        parts.pop()
+    return '.'.join(parts)
+
+def module_node(module):
+    return f"{module}:<module>"
+
+def unit_node(module, qualname):
+    return f"{module}:{qualname}"
+
+def resolve_import(module, is_package, binding):
+    """The absolute dotted path an import binding refers to."""
+    local, source, name, level = binding
+    if level:
+        package = module.split('.') if is_package else module.split('.')[:-1]
+        package = package[:len(package) - (level - 1)]
+        source = '.'.join(package + ([source] if source else []))
+    return f"{source}.{name}" if name else source
+
+class ProjectIndex:
+    """
+    Per-module definitions and resolved import bindings built from the
+    project summaries ({path: analyze_code(..., project_summary=True)
+    ['project_summary']}), used to resolve dotted names in a module to the
+    project's own functions, methods and classes. Where a module defines a
+    qualified name twice, the first definition wins.
+    """
+    def __init__(self, summaries, root):
+        self.modules = {}
+        for path, summary in summaries.items():
+            module = module_name(path, root)
+            is_package = os.path.basename(path) == '__init__.py'
+            self.modules[module] = {
+                'path': path,
+                'definitions': summary['definitions'],
+                'imports': {binding[0]: resolve_import(module, is_package, binding)
+                            for binding in summary['imports']},
+                'calls': summary['calls']
+            }
+
+    def resolve_name(self, module, scope, dotted):
+        """
+        (module, qualname) of the definition `dotted` refers to when used
+        inside the unit `scope` (None at module level), or None if it is not
+        project code. Local definitions are searched from the innermost
+        function scope outwards (class bodies are not visible from their
+        methods), then import bindings.
+        """
+        info = self.modules[module]
+        head, _, rest = dotted.partition('.')
+        for prefix in self.enclosing_scopes(info['definitions'], scope):
+            if prefix + head in info['definitions']:
+                return self.resolve_in_module(module, prefix + dotted)
+        if head in info['imports']:
+            return self.resolve_dotted(info['imports'][head] + ('.' + rest if rest else ''))
+        return None
+
+    def resolve_call(self, module, caller, callee):
+        """Graph node of the function or method a call runs, or None."""
+        head, _, rest = callee.partition('.')
+        if head in ('self', 'cls') and caller is not None:
+            cls = self.enclosing_class(self.modules[module]['definitions'], caller)
+            target = self.resolve_in_module(module, f"{cls}.{rest}") if cls and rest else None
+        else:
+            target = self.resolve_name(module, caller, callee)
+        if target is None:
+            return None
+        module, qualname = target
+        definitions = self.modules[module]['definitions']
+        if definitions[qualname]['type'] == 'class':
+            # Calling a class runs its __init__.
+            qualname += '.__init__'
+            if qualname not in definitions:
+                return None
+        return unit_node(module, qualname)
+
+    def enclosing_class(self, definitions, qualname):
+        while '.' in qualname:
+            qualname = qualname.rsplit('.', 1)[0]
+            if definitions[qualname]['type'] == 'class':
+                return qualname
+        return None
+
+    def enclosing_scopes(self, definitions, scope):
+        qualname = scope
+        while qualname:
+            if definitions[qualname]['type'] != 'class':
+                yield qualname + '.'
+            qualname = qualname.rsplit('.', 1)[0] if '.' in qualname else None
+        yield ''
+
+    def resolve_dotted(self, dotted, depth=0):
+        parts = dotted.split('.')
+        for i in range(len(parts) - 1, 0, -1):
+            module = '.'.join(parts[:i])
+            if module in self.modules:
+                return self.resolve_in_module(module, '.'.join(parts[i:]), depth)
+        return None
+
+    def resolve_in_module(self, module, qualname, depth=0):
+        if depth > MAX_RESOLVE_DEPTH:
+            return None
+        info = self.modules[module]
+        if qualname in info['definitions']:
+            return module, qualname
+        head, _, rest = qualname.partition('.')
+        if head not in info['imports']:
+            return None
+        return self.resolve_dotted(info['imports'][head] + ('.' + rest if rest else ''), depth + 1)
@@ -0,0 +1,418 @@
+import glob
+import json
+import os
+import signal
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from code_metrics_integrated import MAX_VALUES, analyze_code
+from halstead import HalsteadCounts
+from maintainability import DEFAULT_MI_VARIANT
+
+# Static metrics that are averaged (rather than summed) and maxed when merging
+# per-file results into a project report.
+AVERAGED_METRICS = (
+    "Comment Density",
+    "Maintainability Index",
+    "Lack of Cohesion of Methods (LCOM)",
+)
+MAXED_METRICS = (
+    "Depth of Inheritance Tree (DIT)",
+)
+SKIPPED_DIRS = ('__pycache__', 'venv', 'node_modules')
+HALSTEAD_METRICS = {
+    "Unique Operators": 'unique_operators',
+    "Unique Operands": 'unique_operands',
+    "Total Operators": 'total_operators',
+    "Total Operands": 'total_operands',
+    "Volume": 'volume',
+    "Difficulty": 'difficulty',
+    "Effort": 'effort',
+    "Time": 'time',
+    "Bugs": 'bugs',
+}
+
+# Seconds past the per-file timeout the pool waits for a worker to report
+# its own timeout. A worker stuck in C code (a huge parse, a runaway regex)
+# never sees its alarm, so the pool gives up on it then.
+TIMEOUT_GRACE = 2
+
+class AnalysisTimeout(Exception):
+    pass
+
+def collect_files(target):
+    """
+    Expand a file, directory or glob pattern into the sorted list of Python
+    files to analyze.
+    """
+    if os.path.isfile(target):
+        return [target]
+    if os.path.isdir(target):
+        files = []
+        for root, dirs, filenames in os.walk(target):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in SKIPPED_DIRS]
+            files.extend(os.path.join(root, name) for name in filenames if name.endswith('.py'))
+        return sorted(files)
+    return sorted(path for path in glob.glob(target, recursive=True)
+                  if os.path.isfile(path) and path.endswith('.py'))
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _raise_timeout(signum, frame):
+    raise AnalysisTimeout()
+
+def analyze_file(filepath, timeout=None, options=None):
+    """
+    Worker entry point. Always returns (filepath, metrics, error) so a bad
+    file is reported instead of taking the batch down with it. `options` are
+    passed on to analyze_code (granular, project_summary, halstead_counts,
+    mi_variant, max_values).
+    """
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return filepath, analyze_code(filepath, **(options or {})), None
+    except AnalysisTimeout:
+        return filepath, None, f"timed out after {timeout}s"
+    except Exception as e:
+        return filepath, None, f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+def file_options(options, sources, path):
+    # Analyze the source the caller already read (and keyed the cache by),
+    # not whatever the file holds by the time a worker gets to it.
+    if sources and path in sources:
+        return dict(options or {}, code=sources[path])
+    return options
+
+def run_window(queue, workers, timeout, results, errors, options=None, sinks=(), sources=None):
+    """
+    Analyze files from the queue keeping at most `workers` in flight. If a
+    worker dies hard (e.g. a C-level stack overflow) the pool is broken: the
+    files that were in flight are returned as suspects and the rest of the
+    queue is left for a fresh pool. A file still running TIMEOUT_GRACE
+    seconds past its timeout is reported as timed out and its pool is
+    stopped; the other files in flight go back on the queue. Each result is
+    also passed to the add() of every sink as it arrives.
+    """
+    suspects = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        deadlines = {}
+        while (queue or in_flight) and not suspects:
+            while queue and len(in_flight) < workers:
+                path = queue.pop()
+                future = executor.submit(analyze_file, path, timeout, file_options(options, sources, path))
+                in_flight[future] = path
+                if timeout:
+                    deadlines[future] = time.monotonic() + timeout + TIMEOUT_GRACE
+            wait_time = max(0, min(deadlines.values()) - time.monotonic()) if deadlines else None
+            done, _ = wait(in_flight, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = in_flight.pop(future)
+                deadlines.pop(future, None)
+                try:
+                    _, metrics, error = future.result()
+                except BrokenProcessPool:
+                    suspects.append(path)
+                    continue
+                if error:
+                    errors[path] = error
+                else:
+                    results[path] = metrics
+                    for sink in sinks:
+                        sink.add(metrics)
+            now = time.monotonic()
+            overdue = [future for future, deadline in deadlines.items() if deadline <= now]
+            if overdue:
+                for future in overdue:
+                    errors[in_flight.pop(future)] = f"timed out after {timeout}s"
+                queue.extend(in_flight.values())
+                in_flight.clear()
+                stop_pool(executor)
+                break
+        suspects.extend(in_flight.values())
+    return suspects
+
+def stop_pool(executor):
+    # Shutting the pool down waits for its workers, and a stuck one would
+    # never finish; end them all instead.
+    for process in list(executor._processes.values()):
+        process.terminate()
+
+def run_pool(files, workers, timeout, options=None, sinks=(), sources=None):
+    results, errors = {}, {}
+    queue = list(reversed(files))
+    suspects = []
+    while queue:
+        suspects.extend(run_window(queue, workers, timeout, results, errors, options, sinks, sources))
+    # Re-run each file caught in a crashed pool on its own, so only the file
+    # that actually kills its worker is reported.
+    for path in suspects:
+        if run_window([path], 1, timeout, results, errors, options, sinks, sources):
+            errors[path] = "worker process crashed"
+    return results, errors
+
+def lookup_cached(files, cache, results, sources, sinks=()):
+    """
+    Serve unchanged files straight from the cache. Returns the files that
+    still need analyzing, with the cache key each result should be stored
+    under; their source, as read for the key, goes in `sources`.
+    """
+    misses = {}
+    for path in files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                code = f.read()
+        except (OSError, UnicodeDecodeError):
+            # Let the worker hit and report the same error.
+            misses[path] = None
+            continue
+        key = cache.key(code)
+        cached = cache.get(key)
+        if cached is None:
+            misses[path] = key
+            sources[path] = code
+        else:
+            results[path] = cached
+            for sink in sinks:
+                sink.add(cached)
+    return misses
+
+def project_root(target, files):
+    """
+    Directory module names are taken relative to: the target directory (or
+    the common directory of the matched files), moved up past any enclosing
+    packages so absolute imports of the project's own modules resolve.
+    """
+    if os.path.isdir(target):
+        root = target
+    elif files:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+    else:
+        root = '.'
+    root = os.path.abspath(root)
+    while os.path.isfile(os.path.join(root, '__init__.py')) and os.path.dirname(root) != root:
+        root = os.path.dirname(root)
+    return root
+
+class ProjectAggregate:
+    """
+    Running totals behind the project-level static and McCall blocks. Files
+    are added and removed one at a time, so re-analyzing a file updates the
+    project metrics without revisiting the others. Built by adding files
+    only, it reports exactly what a merge of those files gives; removals
+    may leave float sums off in the last digits.
+    """
+    def __init__(self):
+        self.files = 0
+        self.static_totals = {}
+        self.maxed = {name: Counter() for name in MAXED_METRICS}
+        self.mccall_totals = {}
+        self.halstead = HalsteadCounts()
+        self.without_counts = 0
+
+    def add(self, metrics):
+        self.files += 1
+        for name, value in metrics['static_metrics'].items():
+            if not isinstance(value, (int, float)):
+                continue
+            if name in MAXED_METRICS:
+                self.static_totals.setdefault(name, 0)
+                self.maxed[name][value] += 1
+            else:
+                self.static_totals[name] = self.static_totals.get(name, 0) + value
+        for name, value in metrics['intermediate_level_metrics'].items():
+            self.mccall_totals[name] = self.mccall_totals.get(name, 0) + value
+        if 'halstead_counts' in metrics:
+            self.halstead.update(HalsteadCounts.from_json(metrics['halstead_counts']))
+        else:
+            self.without_counts += 1
+
+    def remove(self, metrics):
+        self.files -= 1
+        for name, value in metrics['static_metrics'].items():
+            if not isinstance(value, (int, float)):
+                continue
+            if name in MAXED_METRICS:
+                self.maxed[name][value] -= 1
+            else:
+                self.static_totals[name] -= value
+        for name, value in metrics['intermediate_level_metrics'].items():
+            self.mccall_totals[name] -= value
+        if 'halstead_counts' in metrics:
+            self.halstead.subtract(HalsteadCounts.from_json(metrics['halstead_counts']))
+        else:
+            self.without_counts -= 1
+
+    def report(self):
+        if not self.files:
+            return {}
+        static_totals = dict(self.static_totals)
+        for name, values in self.maxed.items():
+            if name in static_totals:
+                static_totals[name] = max([0] + [value for value, count in values.items() if count > 0])
+        for name in AVERAGED_METRICS:
+            if name in static_totals:
+                static_totals[name] /= self.files
+        if not self.without_counts:
+            # Distinct operators and operands do not add up across files; merge
+            # the per-file counts instead.
+            halstead = self.halstead.report()
+            for name, key in HALSTEAD_METRICS.items():
+                static_totals[name] = halstead[key]
+        return {
+            'static_metrics': static_totals,
+            'intermediate_level_metrics': {
+                name: total / self.files for name, total in self.mccall_totals.items()
+            }
+        }
+
+def merge_project_metrics(results):
+    """Combine per-file metrics into project-level static and McCall blocks."""
+    aggregate = ProjectAggregate()
+    for metrics in results.values():
+        aggregate.add(metrics)
+    return aggregate.report()
+
+def run_local(files, timeout, unit_cache, options=None, sinks=(), sources=None):
+    results, errors = {}, {}
+    for path in files:
+        _, metrics, error = analyze_file(path, timeout,
+                                         dict(file_options(options, sources, path) or {}, unit_cache=unit_cache))
+        if error:
+            errors[path] = error
+        else:
+            results[path] = metrics
+            for sink in sinks:
+                sink.add(metrics)
+    return results, errors
+
+def analyze_files(files, workers, timeout, cache=None, options=None, unit_cache=None, sinks=()):
+    """
+    Metrics of `files`, served from the cache where possible and computed on
+    the worker pool otherwise. With a `unit_cache` (metrics_cache.UnitCache)
+    they are computed in this process instead, re-walking only the functions
+    and classes the unit cache has not seen. Every result, cached or not, is
+    passed to the add() of each of `sinks` (e.g. a ProjectAggregate or
+    thresholds.MetricSketches) as soon as it is at hand. Returns (results,
+    errors, cache hits).
+    """
+    results = {}
+    sources = {}
+    if cache:
+        # Lookups and stores are each one short transaction; the cache is not
+        # held while the files are analyzed.
+        with cache.transaction():
+            misses = lookup_cached(files, cache, results, sources, sinks)
+    else:
+        misses = dict.fromkeys(files)
+    cache_hits = len(results)
+    errors = {}
+    if misses:
+        if unit_cache is not None:
+            analyzed, errors = run_local(list(misses), timeout, unit_cache, options, sinks, sources)
+        else:
+            analyzed, errors = run_pool(list(misses), min(workers, len(misses)), timeout, options, sinks,
+                                        sources)
+        results.update(analyzed)
+    if cache:
+        with cache.transaction():
+            for path, key in misses.items():
+                if key and path in results:
+                    cache.put(key, results[path])
+    return results, errors, cache_hits
+
+def analyze_project(target, workers=None, timeout=60, cache=None, granular=False, call_graph=False,
+                    hierarchy=False, base=None, mi_variant=DEFAULT_MI_VARIANT, max_values=MAX_VALUES,
+                    sinks=()):
+    files = collect_files(target)
+    workers = workers or available_cores()
+    options = {'granular': granular, 'project_summary': call_graph or hierarchy, 'halstead_counts': True,
+               'mi_variant': mi_variant, 'max_values': max_values}
+    results, errors, cache_hits = analyze_files(files, workers, timeout, cache, options, sinks=sinks)
+    report = {
+        'summary': {
+            'files_analyzed': len(results),
+            'files_failed': len(errors),
+            'cache_hits': cache_hits,
+            'workers': workers
+        },
+        'project_metrics': merge_project_metrics(results) if results else {},
+        'files': dict(sorted(results.items())),
+        'errors': dict(sorted(errors.items()))
+    }
+    if call_graph or hierarchy:
+        # Summaries are only the graphs' input; they stay in the cache but
+        # are left out of the per-file report.
+        summaries = {path: metrics.pop('project_summary') for path, metrics in report['files'].items()}
+        root = project_root(target, files)
+    if call_graph:
+        from call_graph import build_call_graph, call_graph_report
+        report['call_graph'] = call_graph_report(build_call_graph(summaries, root))
+    if hierarchy:
+        from class_hierarchy import build_class_hierarchy, apply_to_granular
+        report['class_hierarchy'] = build_class_hierarchy(summaries, root)
+        if granular:
+            apply_to_granular(report['class_hierarchy'], report['files'])
+    if base:
+        report['delta'] = incremental_delta(base, target, files, report, cache, options)
+        report['summary']['changed_files'] = len(report['delta']['files'])
+    for metrics in report['files'].values():
+        metrics.pop('halstead_counts', None)
+    return report
+
+def incremental_delta(base, target, files, report, cache, options):
+    """
+    Before/after metrics of the files changed since the `base` revision,
+    per file and per function, and of the project aggregates. Unchanged
+    files were served from the cache; the base versions of changed files
+    usually are too, after a run on the base revision.
+    """
+    from incremental import analyze_base_versions, changed_files, compare_metrics, file_delta
+    status, toplevel = changed_files(base, target, files)
+    before, before_errors = analyze_base_versions(base, status, toplevel, cache, options)
+    baseline = {path: metrics for path, metrics in report['files'].items() if path not in status}
+    baseline.update(before)
+    return {
+        'base': base,
+        'files': {
+            path: file_delta(change, before.get(path), report['files'].get(path),
+                             report['errors'].get(path) or before_errors.get(path))
+            for path, change in sorted(status.items())
+        },
+        'project_metrics': compare_metrics(merge_project_metrics(baseline) if baseline else {},
+                                           report['project_metrics'])
+    }
+
+def write_project_report(report, output_file):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Analyzed {report['summary']['files_analyzed']} files "
+          f"({report['summary']['files_failed']} failed, "
+          f"{report['summary']['cache_hits']} from cache) with "
+          f"{report['summary']['workers']} workers.")
+    for path, error in report['errors'].items():
+        print(f"  {path}: {error}")
+    if 'delta' in report:
+        changes = [delta['status'] for delta in report['delta']['files'].values()]
+        print(f"Changed since {report['delta']['base']}: {len(changes)} files "
+              f"({changes.count('added')} added, {changes.count('deleted')} deleted).")
+    if 'class_hierarchy' in report:
+        hierarchy = report['class_hierarchy']['summary']
+        print(f"Class hierarchy: {hierarchy['classes']} classes, maximum DIT {hierarchy['max_dit']}, "
+              f"{hierarchy['unresolved_bases']} bases outside the project.")
+    if 'call_graph' in report:
+        graph = report['call_graph']
+        print(f"Call graph: {graph['summary']['functions']} functions, {graph['summary']['edges']} call edges, "
+              f"{len(graph['dead_function_candidates'])} dead-function candidates.")
+    print(f"Project metrics saved to '{output_file}'.")
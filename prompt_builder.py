@@ -0,0 +1,155 @@
+import json
+import math
+import re
+import tokenize
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Bump whenever the prompt wording or layout changes so cached analyses are
+# not reused.
+PROMPT_VERSION = 3
+DEFAULT_PROMPT_BUDGET = 12000
+
+PROMPT_HEADER = (
+    "You are an expert software engineer and code quality analyst. "
+    "Below is a Python program and its corresponding metrics. "
+    "I need an analysis report on how to improve this code, identifying specific areas and suggesting improvements.\n\n"
+)
+PROMPT_FOOTER = (
+    "Please provide detailed feedback on what can be improved in this code, including refactoring suggestions, best practices, and explanations of where and why changes should be made."
+    "Don't give these type of starting lines, Certainly! Here's a detailed analysis of the provided Python code along with suggestions for improvements that can be made to enhance code quality, maintainability, and readability."
+)
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """
+    Count prompt tokens locally: exactly with tiktoken when it is installed,
+    otherwise estimated from word and punctuation runs.
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text))
+    return sum(math.ceil(len(word) / 4) for word in TOKEN_PATTERN.findall(text))
+
+def function_units(granular):
+    """
+    Functions and methods from an analysis' granular metrics, leaving out
+    those defined inside another function, hottest (by cyclomatic
+    complexity) first.
+    """
+    units = []
+    outer_end = 0
+    for metrics in sorted(granular.values(), key=lambda metrics: metrics['lines'][0]):
+        start, end = metrics['lines']
+        if metrics['type'] == 'class' or start <= outer_end:
+            continue
+        outer_end = end
+        units.append({
+            'name': metrics['qualified_name'],
+            'start': start,
+            'end': end,
+            'complexity': metrics['cyclomatic_complexity'] or 0
+        })
+    return sorted(units, key=lambda unit: (-unit['complexity'], unit['start']))
+
+def signature(lines, start):
+    """The header of the function defined at line `start`, up to its colon, on one line."""
+    rows = iter(lines[start - 1:])
+    parts = []
+    depth = 0
+    previous = None
+    for token in tokenize.generate_tokens(lambda: next(rows) + '\n'):
+        if token.type in (tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT):
+            continue
+        if token.type == tokenize.OP and token.string in '([{':
+            depth += 1
+        elif token.type == tokenize.OP and token.string in ')]}':
+            depth -= 1
+        elif token.type == tokenize.OP and token.string == ':' and depth == 0:
+            break
+        if previous is not None and token.start != previous.end:
+            parts.append(' ')
+        parts.append(token.string)
+        previous = token
+    return ''.join(parts)
+
+def assemble_prompt(code_section, metrics_json):
+    return (
+        PROMPT_HEADER +
+        code_section +
+        "Code Metrics:\n"
+        f"{metrics_json}\n\n" +
+        PROMPT_FOOTER
+    )
+
+def code_section(units, summarized, verbatim):
+    sections = [
+        f"Python Code (the {len(verbatim)} most complex of {len(units)} functions are shown in full; "
+        "module-level code is omitted):\n"
+    ]
+    for unit in sorted(verbatim, key=lambda unit: unit['start']):
+        sections.append(f"# {unit['name']}\n{unit['source']}\n")
+    shown = {unit['start'] for unit in verbatim}
+    listed = [unit['summary'] for unit in sorted(summarized, key=lambda unit: unit['start'])
+              if unit['start'] not in shown]
+    if listed:
+        sections.append("Other functions (signature and metrics only):\n" + "\n".join(listed) + "\n")
+    if len(summarized) < len(units):
+        sections.append(f"{len(units) - len(summarized)} more functions omitted.\n")
+    return "\n".join(sections) + "\n"
+
+def build_prompt(code, metrics, granular, budget=DEFAULT_PROMPT_BUDGET):
+    """
+    Build the analysis prompt within `budget` tokens. Small files are sent
+    whole. For larger ones, functions are ranked by the cyclomatic
+    complexity in `granular` (the analysis' granular_metrics): the highest
+    ranked are summarized as signatures with their metrics while the budget
+    allows, the hottest of those are then shown verbatim, and the rest are
+    only counted. Only metrics too large for the budget on their own can
+    push the prompt past it.
+    """
+    metrics_json = json.dumps(metrics, separators=(',', ':'))
+    prompt = assemble_prompt(f"Python Code:\n{code}\n\n", metrics_json)
+    if count_tokens(prompt) <= budget:
+        return prompt
+
+    lines = code.splitlines()
+    units = function_units(granular)
+    for unit in units:
+        unit['source'] = "\n".join(lines[unit['start'] - 1:unit['end']])
+        unit['summary'] = (f"{signature(lines, unit['start'])}  "
+                           f"# lines {unit['start']}-{unit['end']}, CC {unit['complexity']}, "
+                           f"LOC {unit['end'] - unit['start'] + 1}")
+    remaining = budget - count_tokens(assemble_prompt(code_section(units, [], []), metrics_json))
+    summarized = []
+    for unit in units:
+        cost = count_tokens(unit['summary']) + 1
+        if cost > remaining:
+            break
+        summarized.append(unit)
+        remaining -= cost
+    # Then swap in full source for the hottest summarized functions while
+    # the budget allows.
+    verbatim = []
+    for unit in summarized:
+        cost = count_tokens(f"# {unit['name']}\n{unit['source']}\n") - count_tokens(unit['summary'])
+        if cost <= remaining:
+            verbatim.append(unit)
+            remaining -= cost
+    # Tokens of the parts need not add up to those of the whole; drop the
+    # least complex functions until it fits.
+    prompt = assemble_prompt(code_section(units, summarized, verbatim), metrics_json)
+    while count_tokens(prompt) > budget and summarized:
+        (verbatim or summarized).pop()
+        prompt = assemble_prompt(code_section(units, summarized, verbatim), metrics_json)
+    return prompt
@@ -0,0 +1,115 @@
+import argparse
+import ast
+import sys
+
+from code_metrics_integrated import CodeMetricsAnalyzer
+from complexity import FUNCTION_TYPES
+from project_metrics import collect_files
+
+# radon's raw field for each of our line kinds.
+RAW_FIELDS = {'physical': 'loc', 'logical': 'lloc', 'source': 'sloc', 'comment': 'comments', 'blank': 'blank'}
+# radon's HalsteadReport field for each key of our Halstead report.
+HALSTEAD_FIELDS = {
+    'unique_operators': 'h1', 'unique_operands': 'h2', 'total_operators': 'N1', 'total_operands': 'N2',
+    'volume': 'volume', 'difficulty': 'difficulty', 'effort': 'effort', 'time': 'time', 'bugs': 'bugs',
+}
+
+def radon_functions(node):
+    """Functions radon's Halstead visitor reports on their own: those not nested in another function."""
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, FUNCTION_TYPES):
+            yield child
+        else:
+            yield from radon_functions(child)
+
+def radon_blocks(blocks):
+    """cc_visit's blocks with their closures, methods and inner classes, by `name:line`."""
+    named = {}
+    for block in blocks:
+        named[f'{block.name}:{block.lineno}'] = block.complexity
+        named.update(radon_blocks(getattr(block, 'closures', []) + getattr(block, 'methods', [])
+                                  + getattr(block, 'inner_classes', [])))
+    return named
+
+def complexity_blocks(counter):
+    """Complexity of every function, method and class the counter reports, by `name:line`."""
+    return {f'{node.name}:{node.lineno}': complexity for node, complexity in counter.blocks()}
+
+def uses_try_star(tree):
+    # complexity.py counts `try/except*` like `try/except` on purpose; radon
+    # does not count it at all.
+    return hasattr(ast, 'TryStar') and any(isinstance(node, ast.TryStar) for node in ast.walk(tree))
+
+def compare(expected, actual, fields):
+    return {ours: (getattr(expected, theirs), actual[ours])
+            for ours, theirs in fields.items() if getattr(expected, theirs) != actual[ours]}
+
+def file_mismatches(filepath):
+    """
+    Line counts, Halstead counts, cyclomatic complexity and MI of one file
+    that differ from radon's, as {where: {metric: (radon, ours)}}. Files
+    radon cannot parse are skipped, and so are the complexity and MI of files
+    using `try/except*`.
+    """
+    from radon.complexity import cc_visit
+    from radon.metrics import h_visit, mi_visit
+    from radon.raw import analyze
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        code = f.read()
+    try:
+        raw = analyze(code)
+        halstead = h_visit(code)
+        blocks = cc_visit(code)
+        mi = mi_visit(code, multi=False)
+    except (SyntaxError, RecursionError):
+        return {}
+    analyzer = CodeMetricsAnalyzer(filepath, code)
+    mismatches = {
+        'lines': compare(raw, analyzer.line_counts, RAW_FIELDS),
+        'halstead': compare(halstead.total, analyzer.calculate_halstead_metrics(), HALSTEAD_FIELDS),
+    }
+    functions = list(radon_functions(analyzer.tree))
+    if len(functions) != len(halstead.functions):
+        mismatches['functions'] = {'count': (len(halstead.functions), len(functions))}
+    for node, (name, report) in zip(functions, halstead.functions):
+        counts = analyzer.halstead.function_counts(node)
+        mismatches[f'{name}:{node.lineno}'] = compare(report, counts.report(), HALSTEAD_FIELDS)
+    if not uses_try_star(analyzer.tree):
+        expected = radon_blocks(blocks)
+        actual = complexity_blocks(analyzer.complexity)
+        for where in expected.keys() | actual.keys():
+            if expected.get(where) != actual.get(where):
+                mismatches.setdefault(where, {})['cyclomatic_complexity'] = (expected.get(where), actual.get(where))
+        total = sum(block.complexity for block in blocks)
+        if total != analyzer.calculate_cyclomatic_complexity():
+            mismatches['complexity'] = {'total': (total, analyzer.calculate_cyclomatic_complexity())}
+        if mi != analyzer.calculate_maintainability_index():
+            mismatches['maintainability'] = {'mi': (mi, analyzer.calculate_maintainability_index())}
+    return {where: diff for where, diff in mismatches.items() if diff}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the native line counts, Halstead counts, complexity and MI against radon's.")
+    parser.add_argument('target', nargs='?', default='Test_programs',
+                        help="file, directory or glob pattern to check (default: Test_programs)")
+    args = parser.parse_args()
+
+    files = collect_files(args.target)
+    failed = 0
+    for filepath in files:
+        try:
+            mismatches = file_mismatches(filepath)
+        except (SyntaxError, UnicodeDecodeError):
+            continue
+        if mismatches:
+            failed += 1
+            print(filepath)
+            for where, diff in mismatches.items():
+                for metric, (expected, actual) in diff.items():
+                    print(f"  {where} {metric}: radon {expected}, ours {actual}")
+    print(f"{len(files)} files checked, {failed} with mismatches")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import argparse
+import json
+import math
+
+from code_metrics_integrated import MAX_VALUES, MCCALL_INPUTS
+
+DEFAULT_QUANTILE = 0.95
+# Compactor size of the quantile sketches. Rank error shrinks roughly as
+# 1/k; memory grows as k plus a few levels.
+DEFAULT_SKETCH_SIZE = 200
+
+class QuantileSketch:
+    """
+    KLL quantile sketch: a stack of compactors where an item on level h
+    stands for 2**h inputs. When the sketch is full, the first level over
+    its capacity is sorted and every other item is promoted to the next
+    level. Memory stays O(k + log n) items however many values are added,
+    and sketches of separate streams merge into the sketch of the combined
+    stream. Compactions alternate between keeping the odd and the even
+    items, so results do not depend on a random seed.
+    """
+    def __init__(self, k=DEFAULT_SKETCH_SIZE):
+        self.k = k
+        self.levels = [[]]
+        self.parity = [0]
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def capacity(self, level):
+        # Lower levels hold fewer items; the top one holds k.
+        depth = len(self.levels) - level - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def size(self):
+        return sum(len(items) for items in self.levels)
+
+    def max_size(self):
+        return sum(self.capacity(level) for level in range(len(self.levels)))
+
+    def add(self, value):
+        self.levels[0].append(value)
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if self.size() >= self.max_size():
+            self.compress()
+
+    def compress(self):
+        while self.size() >= self.max_size():
+            for level in range(len(self.levels)):
+                if len(self.levels[level]) >= self.capacity(level):
+                    break
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+                self.parity.append(0)
+            items = sorted(self.levels[level])
+            # An odd item out stays behind.
+            self.levels[level] = [items.pop()] if len(items) % 2 else []
+            self.levels[level + 1].extend(items[self.parity[level]::2])
+            self.parity[level] ^= 1
+
+    def update(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+            self.parity.append(0)
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        for bound, pick in (('min', min), ('max', max)):
+            values = [value for value in (getattr(self, bound), getattr(other, bound)) if value is not None]
+            setattr(self, bound, pick(values) if values else None)
+        self.compress()
+
+    def quantile(self, q):
+        """Value at rank q (0 to 1) of everything added, or None if empty."""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        weighted = sorted((value, 2 ** level) for level, items in enumerate(self.levels) for value in items)
+        target = q * sum(weight for _, weight in weighted)
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= target:
+                return value
+        return self.max
+
+    def to_json(self):
+        return {'k': self.k, 'levels': self.levels, 'parity': self.parity,
+                'count': self.count, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_json(cls, data):
+        sketch = cls(data['k'])
+        sketch.levels = [list(items) for items in data['levels']]
+        sketch.parity = list(data['parity'])
+        sketch.count = data['count']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        return sketch
+
+class MetricSketches:
+    """
+    One QuantileSketch per McCall threshold, fed with the static metrics of
+    analyze_code results. Sketches of different shards of a corpus (or of
+    different workers) merge without re-reading any file.
+    """
+    def __init__(self, k=DEFAULT_SKETCH_SIZE):
+        self.sketches = {name: QuantileSketch(k) for name in MAX_VALUES}
+        self.files = 0
+
+    def add(self, metrics):
+        static = metrics['static_metrics']
+        for name, sketch in self.sketches.items():
+            sketch.add(static[MCCALL_INPUTS[name]])
+        self.files += 1
+
+    def update(self, other):
+        for name, sketch in self.sketches.items():
+            sketch.update(other.sketches[name])
+        self.files += other.files
+
+    @classmethod
+    def merge(cls, many):
+        merged = cls()
+        for other in many:
+            merged.update(other)
+        return merged
+
+    def thresholds(self, quantile=DEFAULT_QUANTILE):
+        """
+        max_values for calculate_mccall_metrics: the `quantile` of each metric
+        over the corpus. Metrics whose quantile is not positive (a corpus
+        without inheritance has DIT 0 everywhere) keep the default maximum.
+        """
+        max_values = dict(MAX_VALUES)
+        for name, sketch in self.sketches.items():
+            value = sketch.quantile(quantile)
+            if value is not None and value > 0:
+                max_values[name] = value
+        return max_values
+
+    def to_json(self):
+        return {'files': self.files,
+                'sketches': {name: sketch.to_json() for name, sketch in self.sketches.items()}}
+
+    @classmethod
+    def from_json(cls, data):
+        merged = cls()
+        merged.sketches.update({name: QuantileSketch.from_json(sketch) for name, sketch in data['sketches'].items()})
+        merged.files = data['files']
+        return merged
+
+def calibrate(results, k=DEFAULT_SKETCH_SIZE):
+    """MetricSketches of analyze_code results ({path: metrics} values)."""
+    sketches = MetricSketches(k)
+    for metrics in results:
+        sketches.add(metrics)
+    return sketches
+
+def write_profile(sketches, path, quantile=DEFAULT_QUANTILE):
+    """
+    Save a thresholds profile: the max_values derived at `quantile`, along
+    with the sketches, so profiles of several shards can be merged later.
+    """
+    profile = {
+        'quantile': quantile,
+        'max_values': sketches.thresholds(quantile),
+        **sketches.to_json()
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=4)
+    return profile
+
+def load_profile(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_thresholds(path):
+    """max_values of a thresholds profile, with defaults for any it lacks."""
+    return dict(MAX_VALUES, **load_profile(path)['max_values'])
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge thresholds profiles of several corpus shards.")
+    parser.add_argument('profiles', nargs='+', help="profiles written with --calibrate")
+    parser.add_argument('--output', default='thresholds.json', help="where to write the merged profile")
+    parser.add_argument('--quantile', type=float, default=None,
+                        help="quantile to derive thresholds at (default: that of the first profile)")
+    args = parser.parse_args()
+
+    profiles = [load_profile(path) for path in args.profiles]
+    quantile = args.quantile if args.quantile is not None else profiles[0]['quantile']
+    sketches = MetricSketches.merge(MetricSketches.from_json(profile) for profile in profiles)
+    write_profile(sketches, args.output, quantile)
+    print(f"Merged {len(profiles)} profiles ({sketches.files} files); thresholds saved to '{args.output}'.")
+
+if __name__ == '__main__':
+    main()
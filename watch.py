@@ -0,0 +1,295 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+
+from incremental import compare_metrics, file_delta
+from metrics_cache import UnitCache
+from project_metrics import SKIPPED_DIRS, ProjectAggregate, analyze_files, available_cores, collect_files
+
+DEFAULT_DEBOUNCE = 0.3
+DEFAULT_POLL_INTERVAL = 1.0
+# How long an idle watcher blocks before checking again, so Ctrl-C is
+# noticed promptly.
+IDLE_WAIT = 1.0
+# Batches of at most this many files are analyzed in the watcher's own
+# process, where the unit cache lets an edit re-walk only what it touched;
+# larger ones go to the worker pool.
+INCREMENTAL_BATCH = 8
+# Metric changes listed per file on the terminal, these first; the JSONL
+# stream gets all of them.
+MAX_LISTED_CHANGES = 6
+HEADLINE_METRICS = (
+    "Cyclomatic Complexity",
+    "Maintainability Index",
+    "Lines of Code (LOC)",
+    "Effort",
+    "Comment Density",
+    "Coupling Between Object classes (CBO)",
+    "Lack of Cohesion of Methods (LCOM)",
+)
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+def watched_dir(name):
+    return not name.startswith('.') and name not in SKIPPED_DIRS
+
+class InotifyWatcher:
+    """
+    Paths created, written, moved or deleted under a directory tree (or in
+    just the directory, unless `recursive`), from Linux inotify through
+    libc. Directories created later are watched as they appear. Raises
+    OSError where inotify is not available.
+    """
+    def __init__(self, root, recursive=True):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if libc is None or not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.recursive = recursive
+        self.dirs = {}
+        self.add_tree(root)
+
+    def add_tree(self, root):
+        for directory, dirs, _ in os.walk(root):
+            dirs[:] = [d for d in dirs if watched_dir(d)] if self.recursive else []
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0 and directory == root:
+                raise OSError(ctypes.get_errno(), f"cannot watch {root}")
+            if wd >= 0:
+                self.dirs[wd] = directory
+
+    def wait(self, timeout):
+        """Paths (files or whole directories) changed within `timeout` seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; everything may have changed.
+                    changed.add(self.root)
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                directory = self.dirs.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if self.recursive and watched_dir(os.path.basename(path)):
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            self.add_tree(path)
+                        changed.add(path)
+                elif path.endswith('.py'):
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Changed files of a target found by comparing mtimes and sizes between scans."""
+    def __init__(self, target, interval=DEFAULT_POLL_INTERVAL):
+        self.target = target
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for path in collect_files(self.target):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(max(timeout, self.interval))
+        current = self.scan()
+        changed = {path for path in current.keys() | self.snapshot.keys()
+                   if current.get(path) != self.snapshot.get(path)}
+        self.snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+def make_watcher(target, poll=False):
+    """An InotifyWatcher for directories and files, falling back to polling."""
+    if not poll and (os.path.isdir(target) or os.path.isfile(target)):
+        try:
+            if os.path.isdir(target):
+                return InotifyWatcher(target)
+            return InotifyWatcher(os.path.dirname(target) or '.', recursive=False)
+        except OSError:
+            pass
+    return PollingWatcher(target)
+
+def wait_for_changes(watcher, debounce):
+    """Block until something changes, then until `debounce` seconds pass quietly."""
+    changed = set()
+    while not changed:
+        changed = watcher.wait(IDLE_WAIT)
+    while True:
+        more = watcher.wait(debounce)
+        if not more:
+            return changed
+        changed |= more
+
+def changed_status(target, changed, known):
+    """
+    {path: 'added' | 'modified' | 'deleted'} for the target's Python files
+    among `changed` (files or directories); `known` are the files analyzed
+    so far, under the same names collect_files gives them.
+    """
+    if os.path.isfile(target) or target in known:
+        # A single file, possibly deleted since.
+        candidates = {target} if any(os.path.abspath(path) == os.path.abspath(target)
+                                     for path in changed) else set()
+    else:
+        current = set(collect_files(target))
+        candidates = set()
+        for path in changed:
+            prefix = path.rstrip(os.sep) + os.sep
+            candidates |= {p for p in known | current if p == path or p.startswith(prefix)}
+    status = {}
+    for path in candidates:
+        if os.path.isfile(path):
+            status[path] = 'modified' if path in known else 'added'
+        elif path in known:
+            status[path] = 'deleted'
+    return status
+
+def format_value(value):
+    return '-' if value is None else f"{value:.4g}"
+
+def format_changes(changes):
+    """The first MAX_LISTED_CHANGES changes, headline metrics first."""
+    # Project-level names carry their block ('static_metrics.Fan-in').
+    names = {name: name.split('.', 1)[-1] for name in changes}
+    ordered = sorted(changes, key=lambda name: (HEADLINE_METRICS.index(names[name])
+                                                if names[name] in HEADLINE_METRICS else len(HEADLINE_METRICS)))
+    listed = []
+    for name in ordered[:MAX_LISTED_CHANGES]:
+        change = changes[name]
+        line = f"{names[name]} {format_value(change['before'])} -> {format_value(change['after'])}"
+        if change['change'] is not None:
+            line += f" ({change['change']:+.4g})"
+        listed.append(line)
+    if len(changes) > MAX_LISTED_CHANGES:
+        listed.append(f"... {len(changes) - MAX_LISTED_CHANGES} more")
+    return ', '.join(listed) or 'no metric changes'
+
+def print_batch(batch):
+    for path, delta in batch['files'].items():
+        line = f"[{batch['time']}] {path} {delta['status']}"
+        if delta.get('error'):
+            line += f" (error: {delta['error']})"
+        elif delta['status'] != 'deleted':
+            line += f": {format_changes(delta['static_metrics'])}"
+            units = [unit['status'] for unit in delta['functions'].values()]
+            if units:
+                counts = ', '.join(f"{units.count(status)} {status}" for status in ('added', 'modified', 'removed')
+                                   if status in units)
+                line += f"; functions: {counts}"
+        print(line)
+    if batch['project_metrics']:
+        print(f"  project: {format_changes(batch['project_metrics'])}")
+
+def watch(target, cache=None, options=None, debounce=DEFAULT_DEBOUNCE, jsonl=None, poll=False, workers=None,
+          timeout=60):
+    """
+    Analyze the target, then re-analyze only the files that change, as they
+    are saved. Bursts of saves are coalesced until `debounce` seconds pass
+    without another one. Small batches are analyzed in this process with a
+    unit cache kept for the watcher's lifetime, so from a file's second save
+    on only its changed functions and classes are walked again. Project
+    aggregates are updated file by file. Each batch's metric changes are
+    printed, or appended to `jsonl` as one JSON object per line.
+    """
+    options = dict(options or {}, halstead_counts=True)
+    workers = workers or available_cores()
+    results, errors, _ = analyze_files(collect_files(target), workers, timeout, cache, options)
+    aggregate = ProjectAggregate()
+    for metrics in results.values():
+        aggregate.add(metrics)
+    project = aggregate.report()
+    unit_cache = UnitCache()
+    watcher = make_watcher(target, poll)
+    mode = 'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'
+    print(f"Watching {len(results) + len(errors)} files in '{target}' ({mode}); Ctrl-C to stop.")
+    stream = open(jsonl, 'a', encoding='utf-8') if jsonl else None
+    try:
+        while True:
+            status = changed_status(target, wait_for_changes(watcher, debounce), results.keys() | errors.keys())
+            if not status:
+                continue
+            paths = sorted(path for path, change in status.items() if change != 'deleted')
+            analyzed, failed, _ = analyze_files(paths, min(workers, len(status)), timeout, cache, options,
+                                                unit_cache if len(paths) <= INCREMENTAL_BATCH else None)
+            files = {}
+            for path, change in sorted(status.items()):
+                before = results.pop(path, None)
+                errors.pop(path, None)
+                after = analyzed.get(path)
+                if before:
+                    aggregate.remove(before)
+                if after:
+                    aggregate.add(after)
+                    results[path] = after
+                if path in failed:
+                    errors[path] = failed[path]
+                delta = file_delta(change, before, after, failed.get(path))
+                if change != 'modified' or delta.get('error') or any(
+                        delta[block] for block in ('static_metrics', 'intermediate_level_metrics', 'functions')):
+                    files[path] = delta
+            updated = aggregate.report()
+            batch = {
+                'time': time.strftime('%H:%M:%S'),
+                'files': files,
+                'project_metrics': compare_metrics(project, updated)
+            }
+            project = updated
+            if not files:
+                continue
+            if stream:
+                stream.write(json.dumps(batch) + '\n')
+                stream.flush()
+            else:
+                print_batch(batch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if stream:
+            stream.close()